@@ -1,22 +1,134 @@
-from werkzeug.security import generate_password_hash, check_password_hash
 from flask import Flask, jsonify, request
-from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity
+from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity, decode_token
 from flask_cors import CORS
-from config import get_db_connection
+from config import get_db_connection, get_pool, get_pool_stats, PoolTimeoutError
 from dotenv import load_dotenv
 from apscheduler.schedulers.background import BackgroundScheduler
-from datetime import datetime
-from flask_socketio import SocketIO
+from datetime import datetime, timedelta
+from functools import wraps
+import json
+import re
+from flask_socketio import SocketIO, join_room
+from reference_cache import ReferenceCache
+from cache import LRUCache
+from pagination import PAGE_SIZE_DEFAULT, Page, PaginationError, get_page, init_pagination, paginate_query
+from streaming import ExportError, get_export_format, stream_items, stream_query
+from inventory import StockError, sumar_cantidades, descontar_stock, reponer_stock
+from pricing import PricingError, cotizar, difiere
+from product_import import ProductImportError, leer_filas, importar_productos
+import sales_summary
+import retention
+from leader_lock import leader_lock
+import table_versions
+import product_changes
+from table_versions import TableVersions
+import passwords
+from passwords import HashingBusyError, hash_password, verify_password
+from socket_rooms import RoomMetrics, ScanCoalescer, sala_rut
+from socket_queue import socketio_queue_options
+from audit_log import AuditQueueFullError, AuditWriter
+from json_provider import get_json_provider_class
+from compression import init_compression
+from metrics import init_metrics
+from profiling import init_profiling
+import click
 import os
+import time
 
 load_dotenv()
 
 app = Flask(__name__)
 CORS(app, supports_credentials=True, origins="*")
-socketio = SocketIO(app, cors_allowed_origins="*")
+# Serialización JSON (orjson si está disponible) y compresión gzip/brotli de las respuestas
+app.json = get_json_provider_class(os.getenv('JSON_SERIALIZER'))(app)
+init_compression(app)
+# Con SOCKETIO_MESSAGE_QUEUE (por ejemplo redis://...) varios procesos comparten las emisiones
+socketio = SocketIO(app, cors_allowed_origins="*", **socketio_queue_options(os.getenv('SOCKETIO_MESSAGE_QUEUE')))
 app.config['JWT_SECRET_KEY'] = os.getenv('SECRET_KEY')  # Clave estática para JWT
 jwt = JWTManager(app)
 
+# Respuesta cuando el pool de conexiones está agotado
+@app.errorhandler(PoolTimeoutError)
+def handle_pool_timeout(e):
+    print(f"Pool de conexiones agotado: {e}")
+    return jsonify({"msg": "Servidor ocupado, intente nuevamente"}), 503
+
+# Respuesta cuando el pool de hash de contraseñas está saturado
+@app.errorhandler(HashingBusyError)
+def handle_hashing_busy(e):
+    print(f"Pool de hash de contraseñas saturado: {e}")
+    return jsonify({"msg": "Servidor ocupado, intente nuevamente"}), 503
+
+# Respuesta cuando los parámetros de paginación o exportación no son válidos
+@app.errorhandler(PaginationError)
+@app.errorhandler(ExportError)
+def handle_pagination_error(e):
+    return jsonify({"msg": str(e)}), 400
+
+# Valores instantáneos del pool de conexiones para /metrics
+def pool_gauges():
+    stats = get_pool_stats()
+    return {
+        'db_pool_size': ('Conexiones abiertas en el pool', stats['size']),
+        'db_pool_in_use': ('Conexiones prestadas', stats['in_use']),
+        'db_pool_idle': ('Conexiones libres', stats['idle']),
+        'db_pool_timeouts_total': ('Solicitudes sin conexión disponible a tiempo', stats['timeouts']),
+    }
+
+# Latencia por endpoint, consultas por solicitud y encabezado Server-Timing (ruta /metrics)
+init_metrics(app, gauges=pool_gauges)
+# Perfilado de solicitudes bajo demanda (encabezado X-Profile o muestreo)
+init_profiling(app)
+# Encabezado Deprecation en los listados pedidos sin paginar (limit=all)
+init_pagination(app)
+
+# Caché de las tablas de referencia (ESTADO, TIPOUSUARIO, CATEGORIA, FORMAPAGO, TIPODOCUMENTO)
+referencias = ReferenceCache(get_db_connection, ttl=int(os.getenv('REF_CACHE_TTL', 600)))
+
+# Caché de productos por código de barras (consulta del punto de venta)
+product_cache = LRUCache(
+    max_size=int(os.getenv('PRODUCT_CACHE_SIZE', 5000)),
+    ttl=int(os.getenv('PRODUCT_CACHE_TTL', 60))
+)
+
+# Caché de perfiles de usuario por RUT (consultas frecuentes de /profile)
+profile_cache = LRUCache(
+    max_size=int(os.getenv('PROFILE_CACHE_SIZE', 10000)),
+    ttl=int(os.getenv('PROFILE_CACHE_TTL', 30))
+)
+
+# Escritura en lotes y en segundo plano de REGISTROHISTORIAL
+audit_writer = AuditWriter(get_db_connection)
+
+# Versiones de los catálogos para los ETag (ver migrations/002_versiones_tabla.sql)
+versiones = TableVersions(get_db_connection, ttl=float(os.getenv('VERSION_CACHE_TTL', 1)))
+# Versión del último cambio de cada producto (CAMBIOSPRODUCTO), para validar la caché de productos
+versiones_producto = product_changes.ProductVersions(get_db_connection, ttl=versiones.ttl)
+
+# Decorador que agrega un ETag según la versión de los catálogos indicados y
+# responde 304 sin ejecutar la consulta si el cliente ya tiene esa versión
+def con_etag(*tablas):
+    def decorador(f):
+        @wraps(f)
+        def envoltura(*args, **kwargs):
+            try:
+                etag = versiones.etag(tablas, request.full_path)
+            except Exception as e:
+                print(f"No se pudo obtener la versión de {', '.join(tablas)}: {e}")
+                etag = None
+
+            if etag is not None and request.if_none_match.contains_weak(etag):
+                response = app.response_class(status=304)
+                response.set_etag(etag, weak=True)
+                return response
+
+            response = app.make_response(f(*args, **kwargs))
+            if etag is not None and response.status_code == 200:
+                response.set_etag(etag, weak=True)
+            return response
+        return envoltura
+    return decorador
+
 # Función utilizada para la verificación de RUT
 def validar_rut(rut):
     if len(rut) < 8 or not rut[:-1].isdigit() or not rut[-1].isalnum():
@@ -44,6 +156,26 @@ def validar_rut(rut):
 
     return dv == digito_verificador_calculado
 
+# Tamaño máximo de cada lote de ids en las consultas con IN (...)
+IN_CHUNK_SIZE = int(os.getenv('IN_CHUNK_SIZE', 1000))
+
+# Ejecutar una consulta con IN ({placeholders}) por lotes de ids y devolver todas las filas
+def fetch_in_chunks(cursor, query, ids, chunk_size=IN_CHUNK_SIZE):
+    ids = list(ids)
+    rows = []
+    for start in range(0, len(ids), chunk_size):
+        chunk = ids[start:start + chunk_size]
+        cursor.execute(query.format(placeholders=', '.join(['%s'] * len(chunk))), chunk)
+        rows.extend(cursor.fetchall())
+    return rows
+
+# Agrupar filas de detalle por la columna `key`, quitándola de cada fila
+def group_rows_by(rows, key):
+    grouped = {}
+    for row in rows:
+        grouped.setdefault(row.pop(key), []).append(row)
+    return grouped
+
 #########################################################
 #        Sección Administradores y Cajeros              #
 #########################################################
@@ -67,30 +199,26 @@ def register():
     if not validar_rut(rut):
         return jsonify({"msg": "RUT inválido"}), 400
 
-    password_hash = generate_password_hash(contrasena)
+    # Verificar si el tipo de usuario existe en la tabla TIPOUSUARIO
+    tipo_usuario_id = referencias.get_id('tipo_usuario', tipo_usuario)
+    if tipo_usuario_id is None:
+        return jsonify({"msg": "Tipo de usuario no válido"}), 400
+
+    # Verificar si el estado es válido en la tabla ESTADO
+    estado_id = referencias.get_id('estado', estado)
+    if estado_id is None:
+        return jsonify({"msg": "Estado no válido"}), 400
+
+    password_hash = hash_password(contrasena)
     connection = get_db_connection()
 
     try:
         with connection.cursor() as cursor:
-            # Verificar si el tipo de usuario existe en la tabla TIPOUSUARIO
-            cursor.execute('SELECT id_tipo_usuario FROM TIPOUSUARIO WHERE tipo = %s', (tipo_usuario,))
-            tipo_usuario_id = cursor.fetchone()
-
-            if not tipo_usuario_id:
-                return jsonify({"msg": "Tipo de usuario no válido"}), 400
-
-            # Verificar si el estado es válido en la tabla ESTADO
-            cursor.execute('SELECT id_estado FROM ESTADO WHERE estado = %s', (estado,))
-            estado_id = cursor.fetchone()
-
-            if not estado_id:
-                return jsonify({"msg": "Estado no válido"}), 400
-
             # Insertar el nuevo usuario
             cursor.execute('''
                 INSERT INTO USUARIOS (rut, nombre, apellido, correo, contrasena, telefono, id_tipo_usuario, id_estado)
                 VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-            ''', (rut, nombre, apellido, correo, password_hash, telefono, tipo_usuario_id['id_tipo_usuario'], estado_id['id_estado']))
+            ''', (rut, nombre, apellido, correo, password_hash, telefono, tipo_usuario_id, estado_id))
 
             connection.commit()
         return jsonify({"msg": "Usuario registrado exitosamente"}), 201
@@ -113,62 +241,63 @@ def login():
         with connection.cursor() as cursor:
             cursor.execute('SELECT * FROM USUARIOS WHERE rut = %s', (rut,))
             user = cursor.fetchone()
-
-        if user and check_password_hash(user['contrasena'], contrasena):
-            # Crear token de autenticaciÃ³n con el RUT como identidad
-            access_token = create_access_token(identity={'rut': rut, 'nombre': user['nombre']})
-            return jsonify(access_token=access_token), 200
-        else:
-            return jsonify({"msg": "RUT o contraseÃ±a incorrectos"}), 401
     finally:
+        # Devolver la conexión al pool antes de verificar la contraseña
         connection.close()
 
+    if user and verify_password(user['contrasena'], contrasena):
+        # Crear token de autenticaciÃ³n con el RUT como identidad. El tipo y el id del
+        # usuario viajan como claims para que las rutas protegidas no consulten la base de datos
+        access_token = create_access_token(
+            identity={'rut': rut, 'nombre': user['nombre']},
+            additional_claims={
+                'id_usuario': user['id_usuario'],
+                'tipo_usuario': referencias.get_name('tipo_usuario', user['id_tipo_usuario']),
+            }
+        )
+        return jsonify(access_token=access_token), 200
+    else:
+        return jsonify({"msg": "RUT o contraseÃ±a incorrectos"}), 401
+
 # Ruta para obtener todos los usuarios registrados según el parámetro dado
 @app.route('/users', methods=['GET'])
 def get_users():
     tipo_usuario = request.args.get('tipo_usuario')  # Obtener el parámetro tipo_usuario
-    
+    page = get_page()
+
+    query = '''
+        SELECT 
+            u.id_usuario, 
+            u.rut, 
+            u.nombre, 
+            u.apellido, 
+            u.correo, 
+            u.telefono, 
+            u.fecha_creacion,
+            (SELECT tipo FROM TIPOUSUARIO WHERE id_tipo_usuario = u.id_tipo_usuario) AS tipo_usuario,
+            (SELECT estado FROM ESTADO WHERE id_estado = u.id_estado) AS estado,
+            IFNULL(p.puntos, 0) AS puntos
+        FROM USUARIOS u
+        LEFT JOIN PUNTOS p ON u.id_usuario = p.id_cliente
+    '''
+    conditions = []
+    params = []
+
+    # Filtro opcional por tipo de usuario
+    if tipo_usuario:
+        conditions.append('(SELECT tipo FROM TIPOUSUARIO WHERE id_tipo_usuario = u.id_tipo_usuario) = %s')
+        params.append(tipo_usuario)
+
+    query, params = paginate_query(query, conditions, params, page, ['u.id_usuario'])
+
     connection = get_db_connection()
     try:
         with connection.cursor() as cursor:
-            # Consulta SQL con o sin filtro de tipo_usuario
-            if tipo_usuario:
-                cursor.execute('''
-                    SELECT 
-                        u.id_usuario, 
-                        u.rut, 
-                        u.nombre, 
-                        u.apellido, 
-                        u.correo, 
-                        u.telefono, 
-                        u.fecha_creacion,
-                        (SELECT tipo FROM TIPOUSUARIO WHERE id_tipo_usuario = u.id_tipo_usuario) AS tipo_usuario,
-                        (SELECT estado FROM ESTADO WHERE id_estado = u.id_estado) AS estado,
-                        IFNULL(p.puntos, 0) AS puntos
-                    FROM USUARIOS u
-                    LEFT JOIN PUNTOS p ON u.id_usuario = p.id_cliente
-                    WHERE (SELECT tipo FROM TIPOUSUARIO WHERE id_tipo_usuario = u.id_tipo_usuario) = %s
-                ''', (tipo_usuario,))
-            else:
-                # Si no se proporciona tipo_usuario, devolver todos los usuarios
-                cursor.execute('''
-                    SELECT 
-                        u.id_usuario, 
-                        u.rut, 
-                        u.nombre, 
-                        u.apellido, 
-                        u.correo, 
-                        u.telefono, 
-                        u.fecha_creacion,
-                        (SELECT tipo FROM TIPOUSUARIO WHERE id_tipo_usuario = u.id_tipo_usuario) AS tipo_usuario,
-                        (SELECT estado FROM ESTADO WHERE id_estado = u.id_estado) AS estado,
-                        IFNULL(p.puntos, 0) AS puntos
-                    FROM USUARIOS u
-                    LEFT JOIN PUNTOS p ON u.id_usuario = p.id_cliente
-                ''')
-
+            cursor.execute(query, params)
             users = cursor.fetchall()
-        
+
+        if page:
+            return jsonify(page.result(users, lambda user: [user['id_usuario']])), 200
         return jsonify(users), 200
     finally:
         connection.close()
@@ -209,23 +338,22 @@ def get_user_by_rut(rut):
 # Ruta para cambiar el estado de un usuario a inactivo utilizando su RUT
 @app.route('/users/<string:rut>', methods=['DELETE'])
 def deactivate_user(rut):
+    # Obtener el id del estado 'inactivo' desde la tabla ESTADO
+    estado_inactivo = referencias.get_id('estado', 'inactivo')
+    if estado_inactivo is None:
+        return jsonify({"msg": "Estado inactivo no encontrado"}), 400
+
     connection = get_db_connection()
     try:
         with connection.cursor() as cursor:
-            # Obtener el id del estado 'inactivo' desde la tabla ESTADO
-            cursor.execute('SELECT id_estado FROM ESTADO WHERE estado = %s', ('inactivo',))
-            estado_inactivo = cursor.fetchone()
-
-            if not estado_inactivo:
-                return jsonify({"msg": "Estado inactivo no encontrado"}), 400
-
             # Actualizar el estado del usuario a inactivo
-            cursor.execute('UPDATE USUARIOS SET id_estado = %s WHERE rut = %s', (estado_inactivo['id_estado'], rut))
+            cursor.execute('UPDATE USUARIOS SET id_estado = %s WHERE rut = %s', (estado_inactivo, rut))
             connection.commit()
 
             if cursor.rowcount == 0:
                 return jsonify({'message': 'Usuario no encontrado'}), 404
 
+        profile_cache.delete(rut)
         return jsonify({'message': 'Usuario desactivado exitosamente'}), 200
     finally:
         connection.close()
@@ -263,43 +391,29 @@ def update_user(rut):
         updates.append("telefono = %s")
         params.append(telefono)
     if contrasena:
-        hashed_password = generate_password_hash(contrasena)
+        hashed_password = hash_password(contrasena)
         updates.append("contrasena = %s")
         params.append(hashed_password)
     
     # Si se proporciona el tipo de usuario, validar si existe en la tabla TIPOUSUARIO
     if tipo_usuario:
-        connection = get_db_connection()
-        try:
-            with connection.cursor() as cursor:
-                cursor.execute('SELECT id_tipo_usuario FROM TIPOUSUARIO WHERE tipo = %s', (tipo_usuario,))
-                tipo_usuario_id = cursor.fetchone()
-                
-                if not tipo_usuario_id:
-                    return jsonify({"msg": "Tipo de usuario no válido"}), 400
-                
-                # Si el tipo de usuario es válido, se añade a la lista de campos a actualizar
-                updates.append("id_tipo_usuario = %s")
-                params.append(tipo_usuario_id['id_tipo_usuario'])
-        finally:
-            connection.close()
+        tipo_usuario_id = referencias.get_id('tipo_usuario', tipo_usuario)
+        if tipo_usuario_id is None:
+            return jsonify({"msg": "Tipo de usuario no válido"}), 400
+
+        # Si el tipo de usuario es válido, se añade a la lista de campos a actualizar
+        updates.append("id_tipo_usuario = %s")
+        params.append(tipo_usuario_id)
 
     # Si se proporciona el estado, validar si existe en la tabla ESTADO
     if estado:
-        connection = get_db_connection()
-        try:
-            with connection.cursor() as cursor:
-                cursor.execute('SELECT id_estado FROM ESTADO WHERE estado = %s', (estado,))
-                estado_id = cursor.fetchone()
-                
-                if not estado_id:
-                    return jsonify({"msg": "Estado no válido"}), 400
-                
-                # Si el estado es válido, se añade a la lista de campos a actualizar
-                updates.append("id_estado = %s")
-                params.append(estado_id['id_estado'])
-        finally:
-            connection.close()
+        estado_id = referencias.get_id('estado', estado)
+        if estado_id is None:
+            return jsonify({"msg": "Estado no válido"}), 400
+
+        # Si el estado es válido, se añade a la lista de campos a actualizar
+        updates.append("id_estado = %s")
+        params.append(estado_id)
 
     if not updates:
         return jsonify({"msg": "No hay datos para actualizar"}), 400
@@ -313,6 +427,7 @@ def update_user(rut):
             connection.commit()
 
         if cursor.rowcount > 0:
+            profile_cache.delete(rut)
             return jsonify({"msg": "Usuario actualizado exitosamente"}), 200
         else:
             return jsonify({"msg": "Usuario no encontrado"}), 404
@@ -321,6 +436,7 @@ def update_user(rut):
 
 # Ruta para obtener todos los tipos de usuario
 @app.route('/tiposusuario', methods=['GET'])
+@con_etag('tipousuario')
 def get_all_user_types():
     connection = get_db_connection()
     try:
@@ -373,6 +489,7 @@ def update_user_points(rut):
             # Confirmar cambios en la base de datos
             connection.commit()
 
+        profile_cache.delete(rut)
         return jsonify({"msg": message}), 200
     finally:
         connection.close()
@@ -384,6 +501,19 @@ def profile():
     current_user = get_jwt_identity()
     rut = current_user.get('rut')
 
+    user = fetch_profile(rut)
+    if user:
+        return jsonify(user), 200
+    else:
+        return jsonify({"msg": "Usuario no encontrado"}), 404
+
+# Obtener el perfil de un usuario por su RUT, usando la caché si es posible
+def fetch_profile(rut):
+    user = profile_cache.get(rut)
+    if user is not None:
+        return user
+
+    generation = profile_cache.generation
     connection = get_db_connection()
     try:
         with connection.cursor() as cursor:
@@ -400,14 +530,13 @@ def profile():
                 WHERE u.rut = %s
             ''', (rut,))
             user = cursor.fetchone()
-
-        if user:
-            return jsonify(user), 200
-        else:
-            return jsonify({"msg": "Usuario no encontrado"}), 404
     finally:
         connection.close()
 
+    if user:
+        profile_cache.set(rut, user, generation=generation)
+    return user
+
 # Ruta para obtener los 5 usuarios con mayor cantidad de puntos
 @app.route('/top-users-by-points', methods=['GET'])
 def get_top_users_by_points():
@@ -438,15 +567,20 @@ def get_top_users_by_sales():
     connection = get_db_connection()
     try:
         with connection.cursor() as cursor:
+            # Las ventas por cliente están precalculadas por día en RESUMENVENTACLIENTE
             cursor.execute('''
                 SELECT 
                     CONCAT(u.nombre, ' ', u.apellido) AS nombre_completo,
-                    COUNT(v.id_venta) AS total_ventas
-                FROM USUARIOS u
-                INNER JOIN VENTA v ON u.id_usuario = v.id_cliente
-                GROUP BY u.id_usuario
-                ORDER BY total_ventas DESC
-                LIMIT 5
+                    r.total_ventas
+                FROM (
+                    SELECT id_cliente, CAST(SUM(numero_ventas) AS UNSIGNED) AS total_ventas
+                    FROM RESUMENVENTACLIENTE
+                    GROUP BY id_cliente
+                    ORDER BY total_ventas DESC
+                    LIMIT 5
+                ) r
+                INNER JOIN USUARIOS u ON u.id_usuario = r.id_cliente
+                ORDER BY r.total_ventas DESC
             ''')
             top_users = cursor.fetchall()
 
@@ -460,23 +594,22 @@ def get_top_users_by_sales():
 # Ruta para activar usuarios
 @app.route('/users/<string:rut>/activate', methods=['PUT'])
 def activate_user(rut):
+    # Obtener estado activo
+    estado_activo = referencias.get_id('estado', 'activo')
+    if estado_activo is None:
+        return jsonify({"msg": "Estado activo no encontrado"}), 400
+
     connection = get_db_connection()
     try:
         with connection.cursor() as cursor:
-            # Obtener estado activo
-            cursor.execute('SELECT id_estado FROM ESTADO WHERE estado = %s', ('activo',))
-            estado_activo = cursor.fetchone()
-
-            if not estado_activo:
-                return jsonify({"msg": "Estado activo no encontrado"}), 400
-
             # Actualizar el estado del usuario a activo
-            cursor.execute('UPDATE USUARIOS SET id_estado = %s WHERE rut = %s', (estado_activo['id_estado'], rut))
+            cursor.execute('UPDATE USUARIOS SET id_estado = %s WHERE rut = %s', (estado_activo, rut))
             connection.commit()
 
             if cursor.rowcount == 0:
                 return jsonify({'msg': 'Usuario no encontrado'}), 404
 
+        profile_cache.delete(rut)
         return jsonify({'msg': 'Usuario activado exitosamente'}), 200
     finally:
         connection.close()
@@ -484,9 +617,20 @@ def activate_user(rut):
 #########################################################
 #                   Sección Productos                   #
 #########################################################
-# Ruta para obtener los datos de un producto con su codigo de barras
-@app.route('/product/barcode/<string:codigo_barras>', methods=['GET'])
-def get_product_by_barcode(codigo_barras):
+# Obtener los datos de un producto con su código de barras y la versión de su último
+# cambio, usando la caché si es posible. Cada entrada guarda la versión del producto
+# con que se leyó y se descarta cuando ese producto cambia, también en otro proceso.
+def fetch_product_entry(codigo_barras):
+    try:
+        versiones_producto.refresh()
+    except Exception as e:
+        print(f"No se pudieron leer los cambios de productos: {e}")
+
+    entry = product_cache.get(codigo_barras, is_stale=versiones_producto.is_stale)
+    if entry is not None:
+        return entry
+
+    generation = product_cache.generation
     connection = get_db_connection()
     try:
         with connection.cursor() as cursor:
@@ -504,7 +648,8 @@ def get_product_by_barcode(codigo_barras):
                     cb.codigo AS codigo_barras,
                     pr.precio_venta,
                     e.estado AS estado_producto,
-                    c.nombre_categoria AS categoria
+                    c.nombre_categoria AS categoria,
+                    cp.version AS version_cambio
                 FROM PRODUCTOS p
                 LEFT JOIN STOCK s ON p.id_producto = s.id_producto
                 LEFT JOIN DESCUENTOS d ON p.id_producto = d.id_producto
@@ -512,21 +657,61 @@ def get_product_by_barcode(codigo_barras):
                 LEFT JOIN PRECIO pr ON p.id_producto = pr.id_producto
                 LEFT JOIN ESTADO e ON p.id_estado = e.id_estado
                 LEFT JOIN CATEGORIA c ON p.id_categoria = c.id_categoria
+                LEFT JOIN CAMBIOSPRODUCTO cp ON p.id_producto = cp.id_producto
                 WHERE cb.codigo = %s
             ''', (codigo_barras,))
             
             product = cursor.fetchone()
-
-        if product:
-            return jsonify(product), 200
-        else:
-            return jsonify({"msg": "Producto no encontrado"}), 404
     finally:
         connection.close()
 
+    if not product:
+        return None, None
+
+    version = product.pop('version_cambio') or 0
+    product_cache.set(codigo_barras, (product, version), tag=product['id_producto'],
+                      generation=generation, version=version)
+    return product, version
+
+# Obtener los datos de un producto con su código de barras
+def fetch_product_by_barcode(codigo_barras):
+    return fetch_product_entry(codigo_barras)[0]
+
+# Invalidar las entradas de la caché de productos afectadas por una escritura
+def invalidar_productos(ids_producto=(), codigos_barras=()):
+    for id_producto in ids_producto:
+        # Los ids pueden llegar como texto desde el JSON del cliente
+        product_cache.delete_tag(int(id_producto) if str(id_producto).isdigit() else id_producto)
+    for codigo in codigos_barras:
+        product_cache.delete(codigo)
+    versiones.invalidate()
+    versiones_producto.invalidate()
+
+# Ruta para obtener los datos de un producto con su codigo de barras. El ETag depende
+# solo de la versión del último cambio de ese producto, de modo que las ventas de
+# otros productos no invalidan la copia del cliente.
+@app.route('/product/barcode/<string:codigo_barras>', methods=['GET'])
+def get_product_by_barcode(codigo_barras):
+    product, version = fetch_product_entry(codigo_barras)
+    if not product:
+        return jsonify({"msg": "Producto no encontrado"}), 404
+
+    etag = table_versions.etag_de({f"producto{product['id_producto']}v": version}, request.full_path)
+    if request.if_none_match.contains_weak(etag):
+        response = app.response_class(status=304)
+    else:
+        response = app.make_response((jsonify(product), 200))
+    response.set_etag(etag, weak=True)
+    return response
+
 # Ruta para cambiar el estado de un producto a inactivo dado su codigo de barras
 @app.route('/product/barcode/<string:codigo_barras>', methods=['DELETE'])
 def deactivate_product_by_barcode(codigo_barras):
+    # Obtener el id del estado 'inactivo' desde la tabla ESTADO
+    estado_inactivo = referencias.get_id('estado', 'inactivo')
+    if estado_inactivo is None:
+        return jsonify({"msg": "Estado inactivo no encontrado"}), 400
+
     connection = get_db_connection()
     try:
         with connection.cursor() as cursor:
@@ -537,17 +722,13 @@ def deactivate_product_by_barcode(codigo_barras):
             if not product:
                 return jsonify({"msg": "Producto no encontrado"}), 404
 
-            # Obtener el id del estado 'inactivo' desde la tabla ESTADO
-            cursor.execute('SELECT id_estado FROM ESTADO WHERE estado = %s', ('inactivo',))
-            estado_inactivo = cursor.fetchone()
-
-            if not estado_inactivo:
-                return jsonify({"msg": "Estado inactivo no encontrado"}), 400
-
             # Actualizar el estado del producto a inactivo
-            cursor.execute('UPDATE PRODUCTOS SET id_estado = %s WHERE id_producto = %s', (estado_inactivo['id_estado'], product['id_producto']))
+            cursor.execute('UPDATE PRODUCTOS SET id_estado = %s WHERE id_producto = %s', (estado_inactivo, product['id_producto']))
+            product_changes.registrar(cursor, [product['id_producto']])
             connection.commit()
 
+        invalidar_productos([product['id_producto']], [codigo_barras])
+
         return jsonify({"msg": "Producto marcado como inactivo exitosamente"}), 200
     finally:
         connection.close()
@@ -578,6 +759,15 @@ def update_product_by_barcode(codigo_barras):
         except ValueError:
             return jsonify({"msg": "Formato de fecha inválido para el vencimiento del descuento"}), 400
 
+    # Obtener los ids de estado y categoría desde la caché de referencias
+    id_estado = referencias.get_id('estado', estado_producto)
+    if estado_producto is not None and id_estado is None:
+        return jsonify({"msg": "Estado no válido"}), 400
+
+    id_categoria = referencias.get_id('categoria', categoria)
+    if categoria is not None and id_categoria is None:
+        return jsonify({"msg": "Categoría no válida"}), 400
+
     connection = get_db_connection()
     try:
         with connection.cursor() as cursor:
@@ -592,10 +782,9 @@ def update_product_by_barcode(codigo_barras):
             # Actualizar los detalles del producto
             cursor.execute('''
                 UPDATE PRODUCTOS 
-                SET nombre = %s, descripcion = %s, fecha_vencimiento = %s, id_estado = (SELECT id_estado FROM ESTADO WHERE estado = %s), 
-                id_categoria = (SELECT id_categoria FROM CATEGORIA WHERE nombre_categoria = %s) 
+                SET nombre = %s, descripcion = %s, fecha_vencimiento = %s, id_estado = %s, id_categoria = %s 
                 WHERE id_producto = %s
-            ''', (nombre, descripcion, fecha_vencimiento, estado_producto, categoria, id_producto))
+            ''', (nombre, descripcion, fecha_vencimiento, id_estado, id_categoria, id_producto))
 
             # Actualizar el stock
             cursor.execute('UPDATE STOCK SET stock = %s WHERE id_producto = %s', (stock, id_producto))
@@ -622,21 +811,20 @@ def update_product_by_barcode(codigo_barras):
                         VALUES (%s, %s, %s)
                     ''', (id_producto, descuento, vencimiento_descuento))
 
+            product_changes.registrar(cursor, [id_producto])
             connection.commit()
 
+        invalidar_productos([id_producto], [codigo_barras])
+
         return jsonify({"msg": "Producto actualizado exitosamente"}), 200
     finally:
         connection.close()
 
-# Ruta para agregar un producto
-@app.route('/product', methods=['POST'])
-def add_product():
-    new_data = request.json
+# Validar los datos de un producto nuevo. Devuelve (producto, None) si son
+# correctos o (None, mensaje de error) si no lo son.
+def validar_producto(new_data):
     nombre = new_data.get('nombre')
-    descripcion = new_data.get('descripcion')
-    fecha_vencimiento = new_data.get('fecha_vencimiento')
     stock = new_data.get('stock')
-    descuento = new_data.get('descuento')
     precio_venta = new_data.get('precio_venta')
     estado_producto = new_data.get('estado')
     categoria = new_data.get('categoria')
@@ -645,19 +833,57 @@ def add_product():
 
     # Validar que los campos estén correctos
     if not all([nombre, stock, precio_venta, estado_producto, categoria, codigo_barras]):
-        return jsonify({"msg": "Faltan datos obligatorios"}), 400
+        return None, "Faltan datos obligatorios"
 
     # Validar que si se proporciona un vencimiento de descuento, no sea una fecha anterior a la actual
     if vencimiento_descuento:
         try:
             fecha_vencimiento_descuento = datetime.strptime(vencimiento_descuento, '%Y-%m-%d').date()
-            fecha_actual = datetime.now().date()
-
-            if fecha_vencimiento_descuento <= fecha_actual:
-                return jsonify({"msg": "La fecha de vencimiento del descuento no puede ser igual o anterior a la fecha actual"}), 400
+        except (TypeError, ValueError):
+            return None, "Formato de fecha inválido para el vencimiento del descuento"
+
+        if fecha_vencimiento_descuento <= datetime.now().date():
+            return None, "La fecha de vencimiento del descuento no puede ser igual o anterior a la fecha actual"
+
+    # Obtener los ids de estado y categoría desde la caché de referencias
+    id_estado = referencias.get_id('estado', estado_producto)
+    if id_estado is None:
+        return None, "Estado no válido"
+
+    id_categoria = referencias.get_id('categoria', categoria)
+    if id_categoria is None:
+        return None, "Categoría no válida"
+
+    return {
+        "nombre": nombre,
+        "descripcion": new_data.get('descripcion'),
+        "fecha_vencimiento": new_data.get('fecha_vencimiento'),
+        "stock": stock,
+        "descuento": new_data.get('descuento'),
+        "precio_venta": precio_venta,
+        "id_estado": id_estado,
+        "id_categoria": id_categoria,
+        "codigo_barras": str(codigo_barras),
+        "vencimiento_descuento": vencimiento_descuento,
+    }, None
 
-        except ValueError:
-            return jsonify({"msg": "Formato de fecha inválido para el vencimiento del descuento"}), 400
+# Ruta para agregar un producto
+@app.route('/product', methods=['POST'])
+def add_product():
+    producto, error = validar_producto(request.json)
+    if error:
+        return jsonify({"msg": error}), 400
+
+    nombre = producto['nombre']
+    descripcion = producto['descripcion']
+    fecha_vencimiento = producto['fecha_vencimiento']
+    stock = producto['stock']
+    descuento = producto['descuento']
+    precio_venta = producto['precio_venta']
+    id_estado = producto['id_estado']
+    id_categoria = producto['id_categoria']
+    codigo_barras = producto['codigo_barras']
+    vencimiento_descuento = producto['vencimiento_descuento']
 
     connection = get_db_connection()
     try:
@@ -665,10 +891,8 @@ def add_product():
             # Insertar el nuevo producto
             cursor.execute('''
                 INSERT INTO PRODUCTOS (nombre, descripcion, fecha_registro, fecha_vencimiento, id_estado, id_categoria)
-                VALUES (%s, %s, current_timestamp(), %s, 
-                (SELECT id_estado FROM ESTADO WHERE estado = %s), 
-                (SELECT id_categoria FROM CATEGORIA WHERE nombre_categoria = %s))
-            ''', (nombre, descripcion, fecha_vencimiento, estado_producto, categoria))
+                VALUES (%s, %s, current_timestamp(), %s, %s, %s)
+            ''', (nombre, descripcion, fecha_vencimiento, id_estado, id_categoria))
 
             # Obtener el id_producto
             product_id = connection.insert_id()
@@ -687,20 +911,81 @@ def add_product():
             cursor.execute('INSERT INTO PRECIO (id_producto, precio_venta) VALUES (%s, %s)', (product_id, precio_venta))
 
             # Confirmar los cambios en la base de datos
+            product_changes.registrar(cursor, [product_id])
             connection.commit()
 
+        invalidar_productos([product_id], [codigo_barras])
+
         return jsonify({"msg": "Producto agregado exitosamente"}), 201
     finally:
         connection.close()
 
+# Ruta para importar productos en bloque desde un arreglo JSON o un archivo CSV
+@app.route('/products/bulk', methods=['POST'])
+def bulk_import_products():
+    try:
+        filas = leer_filas(request)
+    except ProductImportError as e:
+        return jsonify({"msg": str(e)}), 400
+
+    # Validar todas las filas antes de escribir (las filas se numeran desde 1)
+    productos = []
+    errores = []
+    codigos_vistos = set()
+    for numero, fila in enumerate(filas, start=1):
+        if not isinstance(fila, dict):
+            errores.append({"fila": numero, "error": "Formato de producto inválido"})
+            continue
+
+        producto, error = validar_producto(fila)
+        if error is None and producto['codigo_barras'] in codigos_vistos:
+            error = "Código de barras repetido en la importación"
+        if error:
+            errores.append({"fila": numero, "codigo_barras": fila.get('codigo_barras'), "error": error})
+            continue
+
+        codigos_vistos.add(producto['codigo_barras'])
+        productos.append((numero, producto))
+
+    insertados = {}
+    if productos:
+        connection = get_db_connection()
+        try:
+            insertados, errores_insercion = importar_productos(connection, productos)
+            errores.extend(errores_insercion)
+        finally:
+            connection.close()
+
+        invalidar_productos(insertados.values(), [producto['codigo_barras'] for _, producto in productos])
+
+    errores.sort(key=lambda error: error['fila'])
+    resultado = {
+        "msg": "Importación finalizada",
+        "total": len(filas),
+        "insertados": len(insertados),
+        "errores": errores
+    }
+    return jsonify(resultado), 201 if insertados else 400
+
 # Ruta para obtener todos los productos
 @app.route('/products', methods=['GET'])
+@con_etag('productos')
 def get_all_products():
+    page = get_page()
+
+    # Un producto puede tener varios códigos de barras y descuentos, y por lo tanto
+    # varias filas: la página se forma con los ids de producto y luego se unen sus datos
+    params = []
+    productos = 'PRODUCTOS p'
+    if page:
+        pagina, params = paginate_query('SELECT p.id_producto FROM PRODUCTOS p', [], [], page, ['p.id_producto'])
+        productos = f'({pagina}) pagina JOIN PRODUCTOS p ON p.id_producto = pagina.id_producto'
+
     connection = get_db_connection()
     try:
         with connection.cursor() as cursor:
             # Consulta SQL para obtener todos los productos y su información
-            cursor.execute('''
+            cursor.execute(f'''
                 SELECT 
                     p.id_producto, 
                     p.nombre, 
@@ -714,23 +999,84 @@ def get_all_products():
                     pr.precio_venta, 
                     e.estado AS estado_producto, 
                     c.nombre_categoria AS categoria
-                FROM PRODUCTOS p
+                FROM {productos}
                 LEFT JOIN STOCK s ON p.id_producto = s.id_producto
                 LEFT JOIN DESCUENTOS d ON p.id_producto = d.id_producto
                 LEFT JOIN CODIGOBARRAS cb ON p.id_producto = cb.id_producto
                 LEFT JOIN PRECIO pr ON p.id_producto = pr.id_producto
                 LEFT JOIN ESTADO e ON p.id_estado = e.id_estado
                 LEFT JOIN CATEGORIA c ON p.id_categoria = c.id_categoria
-            ''')
+                ORDER BY p.id_producto
+            ''', params)
             products = cursor.fetchall()
         
         # Retornar los productos en formato JSON
+        if page:
+            return jsonify(page.grouped_result(products, lambda product: [product['id_producto']])), 200
         return jsonify(products), 200
     finally:
         connection.close()
 
+# Ruta para sincronizar el catálogo: devuelve los productos modificados después de la
+# versión `since`, incluidos los inactivos marcados como eliminados
+@app.route('/products/changes', methods=['GET'])
+def get_product_changes():
+    since = request.args.get('since', '0')
+    if not since.isdigit():
+        return jsonify({"msg": "El parámetro since debe ser un número entero no negativo"}), 400
+
+    page = get_page() or Page(PAGE_SIZE_DEFAULT)
+    connection = get_db_connection()
+    try:
+        with connection.cursor() as cursor:
+            # La versión se lee primero; los cambios posteriores aparecen con una versión mayor
+            version = product_changes.version_actual(cursor)
+
+            # La página se forma con las filas de CAMBIOSPRODUCTO (una por producto) y
+            # luego se unen sus datos, que pueden ocupar varias filas por producto
+            pagina, params = paginate_query(
+                'SELECT cp.version, cp.id_producto, cp.eliminado FROM CAMBIOSPRODUCTO cp',
+                ['cp.version > %s'], [int(since)], page, ['cp.version', 'cp.id_producto'])
+            cursor.execute(f'''
+                SELECT 
+                    cp.version,
+                    cp.eliminado,
+                    p.id_producto, 
+                    p.nombre, 
+                    p.descripcion, 
+                    p.fecha_registro, 
+                    p.fecha_vencimiento, 
+                    s.stock, 
+                    d.porcentaje AS descuento, 
+                    d.vencimiento_descuento,
+                    cb.codigo AS codigo_barras, 
+                    pr.precio_venta, 
+                    e.estado AS estado_producto, 
+                    c.nombre_categoria AS categoria
+                FROM ({pagina}) cp
+                JOIN PRODUCTOS p ON cp.id_producto = p.id_producto
+                LEFT JOIN STOCK s ON p.id_producto = s.id_producto
+                LEFT JOIN DESCUENTOS d ON p.id_producto = d.id_producto
+                LEFT JOIN CODIGOBARRAS cb ON p.id_producto = cb.id_producto
+                LEFT JOIN PRECIO pr ON p.id_producto = pr.id_producto
+                LEFT JOIN ESTADO e ON p.id_estado = e.id_estado
+                LEFT JOIN CATEGORIA c ON p.id_categoria = c.id_categoria
+                ORDER BY cp.version, cp.id_producto
+            ''', params)
+            changes = cursor.fetchall()
+
+        for change in changes:
+            change['eliminado'] = bool(change['eliminado'])
+
+        result = page.grouped_result(changes, lambda change: [change['version'], change['id_producto']])
+        result['version'] = max([version] + [change['version'] for change in result['items']])
+        return jsonify(result), 200
+    finally:
+        connection.close()
+
 # Ruta para obtener todas las categorí­as
 @app.route('/categories', methods=['GET'])
+@con_etag('categorias')
 def get_all_categories():
     connection = get_db_connection()
     try:
@@ -768,8 +1114,13 @@ def add_category():
                 INSERT INTO CATEGORIA (nombre_categoria) 
                 VALUES (%s)
             ''', (nueva_categoria,))
+            table_versions.incrementar(cursor, 'categorias')
             connection.commit()
 
+        # La caché de categorías debe recargarse para incluir la nueva
+        referencias.invalidate('categoria')
+        versiones.invalidate()
+
         return jsonify({"msg": "Categoría agregada exitosamente"}), 201
     except Exception as e:
         return jsonify({"msg": "Ocurrió un error al agregar la categoría", "error": str(e)}), 500
@@ -783,20 +1134,34 @@ def add_category():
 # Ruta para obtener todos los datos de la tabla DETALLEVENTA
 @app.route('/detalleventa', methods=['GET'])
 def get_all_detalle_venta():
+    page = get_page()
     connection = get_db_connection()
     try:
         with connection.cursor() as cursor:
-            # Consulta para obtener todos los registros de DETALLEVENTA
-            cursor.execute('''
+            # Consulta para obtener todos los registros de DETALLEVENTA. Las filas
+            # repetidas de un producto en la misma venta se suman para que la clave
+            # (id_venta, id_producto) identifique cada fila de la página.
+            query, params = paginate_query('''
                 SELECT 
                     dv.id_venta,
-                    dv.cantidad,
-                    p.nombre AS producto_nombre
+                    SUM(dv.cantidad) AS cantidad,
+                    p.nombre AS producto_nombre,
+                    dv.id_producto
                 FROM DETALLEVENTA dv
                 INNER JOIN PRODUCTOS p ON dv.id_producto = p.id_producto
-            ''')
+            ''', [], [], page, ['dv.id_venta', 'dv.id_producto'],
+                group_by=['dv.id_venta', 'dv.id_producto', 'p.nombre'])
+            cursor.execute(query, params)
             detalle_venta = cursor.fetchall()
 
+        if page:
+            result = page.result(detalle_venta, lambda detalle: [detalle['id_venta'], detalle['id_producto']])
+        # id_producto solo se usa como parte de la clave del cursor
+        for detalle in detalle_venta:
+            del detalle['id_producto']
+
+        if page:
+            return jsonify(result), 200
         return jsonify(detalle_venta), 200
     except Exception as e:
         print(f"Error al obtener los detalles de venta: {e}")
@@ -878,42 +1243,55 @@ def get_all_ventas():
     # Obtener los parámetros de fecha de inicio y fin de la solicitud
     fecha_inicio = request.args.get('fecha_inicio')
     fecha_fin = request.args.get('fecha_fin')
+    export_format = get_export_format()
+    page = get_page()
+
+    query = '''
+        SELECT 
+            v.id_venta, 
+            v.id_cliente, 
+            v.id_cajero, 
+            v.total_sin_iva, 
+            v.total_con_iva, 
+            v.fecha_venta, 
+            v.numero_documento, 
+            v.porcentaje, 
+            v.id_forma_pago, 
+            v.id_tipodocumento
+        FROM VENTA v
+    '''
+    conditions = []
+    params = []
+
+    if fecha_inicio and fecha_fin:
+        conditions.append('v.fecha_venta BETWEEN %s AND %s')
+        params.extend([fecha_inicio, fecha_fin])
+    elif fecha_inicio:
+        conditions.append('v.fecha_venta >= %s')
+        params.append(fecha_inicio)
+    elif fecha_fin:
+        conditions.append('v.fecha_venta <= %s')
+        params.append(fecha_fin)
+
+    # Exportación completa en streaming (no se pagina)
+    if export_format:
+        query, params = paginate_query(query, conditions, params, None, [])
+        return stream_query(query + ' ORDER BY v.id_venta', params, export_format)
+
+    query, params = paginate_query(query, conditions, params, page, ['v.id_venta'])
 
     connection = get_db_connection()
     try:
         with connection.cursor() as cursor:
-            query = '''
-                SELECT 
-                    v.id_venta, 
-                    v.id_cliente, 
-                    v.id_cajero, 
-                    v.total_sin_iva, 
-                    v.total_con_iva, 
-                    v.fecha_venta, 
-                    v.numero_documento, 
-                    v.porcentaje, 
-                    v.id_forma_pago, 
-                    v.id_tipodocumento
-                FROM VENTA v
-            '''
-            params = []
-
-            if fecha_inicio and fecha_fin:
-                query += ' WHERE v.fecha_venta BETWEEN %s AND %s'
-                params.extend([fecha_inicio, fecha_fin])
-            elif fecha_inicio:
-                query += ' WHERE v.fecha_venta >= %s'
-                params.append(fecha_inicio)
-            elif fecha_fin:
-                query += ' WHERE v.fecha_venta <= %s'
-                params.append(fecha_fin)
-
             cursor.execute(query, params)
             ventas = cursor.fetchall()
 
-            if not ventas:
+            # Una página posterior vacía no es un error: indica que no quedan ventas
+            if not ventas and not (page and page.after):
                 return jsonify({"msg": "No se encontraron ventas en el rango de fechas proporcionado"}), 404
 
+        if page:
+            return jsonify(page.result(ventas, lambda venta: [venta['id_venta']])), 200
         return jsonify(ventas), 200
     except Exception as e:
         print(f"Error al obtener las ventas: {e}")
@@ -921,6 +1299,22 @@ def get_all_ventas():
     finally:
         connection.close()
 
+# Ruta para consultar las ventas archivadas por la retención (con sus detalles),
+# con los filtros fecha_inicio, fecha_fin, id_cliente e id_cajero
+@app.route('/archivo/ventas', methods=['GET'])
+def get_archived_ventas():
+    desde, hasta, error = rango_fechas_archivo()
+    if error:
+        return jsonify({"msg": error}), 400
+
+    id_cliente = request.args.get('id_cliente', type=int)
+    id_cajero = request.args.get('id_cajero', type=int)
+    def filtro(venta):
+        return ((id_cliente is None or venta['id_cliente'] == id_cliente)
+                and (id_cajero is None or venta['id_cajero'] == id_cajero))
+
+    return stream_items(retention.leer('ventas', desde, hasta, filtro), get_export_format() or 'json')
+
 # Ruta para insertar una nueva venta en la tabla VENTA
 @app.route('/ventas', methods=['POST'])
 def add_venta():
@@ -957,6 +1351,9 @@ def add_venta():
                 ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
             ''', (id_cliente, id_cajero, total_sin_iva, total_con_iva, fecha_venta, numero_documento, porcentaje, id_forma_pago, id_tipodocumento))
 
+            # Actualizar los resúmenes de ventas del día
+            sales_summary.registrar_venta(cursor, cursor.lastrowid, id_cliente, id_cajero, total_con_iva, fecha_venta)
+
             connection.commit()
 
         return jsonify({"msg": "Venta registrada exitosamente"}), 201
@@ -966,31 +1363,71 @@ def add_venta():
     finally:
         connection.close()
 
-# Ruta para insertar una nueva venta y sus detalles
+# Ruta para calcular los precios, descuentos vigentes, IVA y totales de una canasta
+# de productos sin registrar la venta
+@app.route('/ventas/cotizar', methods=['POST'])
+def quote_venta():
+    data = request.get_json(silent=True) or {}
+    productos = data.get('productos')
+
+    if not productos or not isinstance(productos, list):
+        return jsonify({"msg": "Se requiere al menos un producto para cotizar"}), 400
+
+    detalles = leer_detalles_productos(productos)
+    if detalles is None:
+        return jsonify({"msg": "Cada producto debe incluir id_producto y cantidad"}), 400
+
+    connection = get_db_connection()
+    try:
+        with connection.cursor() as cursor:
+            cotizacion = cotizar(cursor, detalles)
+        return jsonify(cotizacion), 200
+    except PricingError as e:
+        return jsonify({"msg": "Hay productos que no existen o no tienen precio", "productos": e.productos}), 400
+    except Exception as e:
+        print(f"Error al cotizar la venta: {e}")
+        return jsonify({"msg": "Ocurrió un error al cotizar la venta"}), 500
+    finally:
+        connection.close()
+
+# Ruta para insertar una nueva venta y sus detalles. Los totales se calculan en el
+# servidor a partir de PRECIO y DESCUENTOS; los que envíe el cliente no se usan.
 @app.route('/ventas-detalle', methods=['POST'])
 def add_venta_with_details():
     data = request.json
     id_cliente = data.get('id_cliente')
     id_cajero = data.get('id_cajero')
-    total_sin_iva = data.get('total_sin_iva')
-    total_con_iva = data.get('total_con_iva')
     fecha_venta = data.get('fecha_venta')
     numero_documento = data.get('numero_documento')
     porcentaje = data.get('porcentaje')
     id_forma_pago = data.get('id_forma_pago')
     id_tipodocumento = data.get('id_tipodocumento')
     productos = data.get('productos')  # Lista de productos
+    # La caja puede pedir el rechazo, pero no desactivarlo si está configurado en el entorno
+    rechazar_sobreventa = STOCK_RECHAZAR_SOBREVENTA or data.get('rechazar_sobreventa') is True
 
     # Validar que los datos estén presentes
-    if not all([id_cliente, id_cajero, total_sin_iva, total_con_iva, fecha_venta, numero_documento, id_forma_pago, id_tipodocumento]):
+    if not all([id_cliente, id_cajero, fecha_venta, numero_documento, id_forma_pago, id_tipodocumento]):
         return jsonify({"msg": "Faltan datos  para la venta"}), 400
 
     if not productos or not isinstance(productos, list) or len(productos) == 0:
         return jsonify({"msg": "Se requiere al menos un producto para registrar la venta"}), 400
 
+    # Validar los productos antes de abrir la transacción
+    detalles = leer_detalles_productos(productos)
+    if detalles is None:
+        return jsonify({"msg": "Cada producto debe incluir id_producto y cantidad"}), 400
+
     connection = get_db_connection()
     try:
         with connection.cursor() as cursor:
+            # Calcular los totales con los precios y descuentos vigentes
+            cotizacion = cotizar(cursor, detalles)
+            total_sin_iva = cotizacion['total_sin_iva']
+            total_con_iva = cotizacion['total_con_iva']
+            if data.get('total_con_iva') is not None and difiere(data.get('total_con_iva'), total_con_iva):
+                print(f"Venta {numero_documento}: total enviado por la caja {data.get('total_con_iva')}, calculado {total_con_iva}")
+
             # Insertar la venta en la tabla VENTA
             cursor.execute('''
                 INSERT INTO VENTA (
@@ -1009,45 +1446,93 @@ def add_venta_with_details():
             # Obtener el ID de la venta recién insertada
             id_venta = cursor.lastrowid
 
-            # Insertar los productos en DETALLEVENTA
-            for producto in productos:
-                id_producto = producto.get('id_producto')
-                cantidad = producto.get('cantidad')
+            # Insertar los productos en DETALLEVENTA con una sola sentencia, una fila
+            # por producto aunque la caja lo haya enviado varias veces
+            cantidades = sumar_cantidades(detalles)
+            cursor.executemany('''
+                INSERT INTO DETALLEVENTA (id_venta, id_producto, cantidad)
+                VALUES (%s, %s, %s)
+            ''', [(id_venta, id_producto, cantidades[id_producto]) for id_producto in sorted(cantidades)])
 
-                if not all([id_producto, cantidad]):
-                    return jsonify({"msg": "Cada producto debe incluir id_producto y cantidad"}), 400
+            # Descontar el stock vendido en la misma transacción
+            descontar_stock(cursor, cantidades, rechazar_sobreventa)
 
-                cursor.execute('''
-                    INSERT INTO DETALLEVENTA (id_venta, id_producto, cantidad)
-                    VALUES (%s, %s, %s)
-                ''', (id_venta, id_producto, cantidad))
+            # Actualizar los resúmenes de ventas del día
+            sales_summary.registrar_venta(cursor, id_venta, id_cliente, id_cajero, total_con_iva, fecha_venta)
 
+            product_changes.registrar(cursor, {id_producto for id_producto, _ in detalles})
             connection.commit()
 
-        return jsonify({"msg": "Venta y detalles registrados exitosamente", "id_venta": id_venta}), 201
+        # Las cantidades vendidas cambian el stock de los productos
+        invalidar_productos({id_producto for id_producto, _ in detalles})
+
+        return jsonify({
+            "msg": "Venta y detalles registrados exitosamente",
+            "id_venta": id_venta,
+            "total_sin_iva": total_sin_iva,
+            "iva": cotizacion['iva'],
+            "total_con_iva": total_con_iva,
+        }), 201
+    except PricingError as e:
+        connection.rollback()
+        return jsonify({"msg": "Hay productos que no existen o no tienen precio", "productos": e.productos}), 400
+    except StockError as e:
+        connection.rollback()
+        return jsonify({"msg": "Stock insuficiente para registrar la venta", "faltantes": e.faltantes}), 409
     except Exception as e:
         print(f"Error al registrar la venta: {e}")
         return jsonify({"msg": "Ocurrió un error al registrar la venta", "error": str(e)}), 500
     finally:
         connection.close()
 
+# Validar la lista de productos de una venta o compra y devolver los pares
+# (id_producto, cantidad), o None si algún producto está incompleto o no es válido
+def leer_detalles_productos(productos):
+    detalles = []
+    for producto in productos:
+        if not isinstance(producto, dict):
+            return None
+        id_producto = producto.get('id_producto')
+        cantidad = producto.get('cantidad')
+        if not all([id_producto, cantidad]):
+            return None
+
+        # El id debe ser entero y la cantidad un número positivo
+        try:
+            id_producto = int(id_producto)
+            cantidad_valida = not isinstance(cantidad, bool) and float(cantidad) > 0
+        except (TypeError, ValueError):
+            return None
+        if not cantidad_valida:
+            return None
+        detalles.append((id_producto, cantidad))
+    return detalles
+
+# Indica si la venta debe rechazarse cuando no hay stock suficiente
+STOCK_RECHAZAR_SOBREVENTA = os.getenv('STOCK_RECHAZAR_SOBREVENTA', 'false').lower() == 'true'
+
 # Ruta para obtener la mejor venta de la semana
 @app.route('/best-sale-of-week', methods=['GET'])
 def get_best_sale_of_week():
     connection = get_db_connection()
     try:
         with connection.cursor() as cursor:
+            # La venta máxima de cada día y cajero está precalculada en RESUMENVENTACAJERO
             cursor.execute('''
                 SELECT 
                     v.id_venta,
                     v.total_con_iva as monto,
                     CONCAT(u.nombre, ' ', u.apellido) as vendedor,
                     v.fecha_venta
-                FROM VENTA v
+                FROM (
+                    SELECT id_venta_maxima
+                    FROM RESUMENVENTACAJERO
+                    WHERE fecha >= DATE_SUB(CURDATE(), INTERVAL 7 DAY)
+                    ORDER BY venta_maxima DESC
+                    LIMIT 1
+                ) r
+                INNER JOIN VENTA v ON v.id_venta = r.id_venta_maxima
                 INNER JOIN USUARIOS u ON v.id_cajero = u.id_usuario
-                WHERE v.fecha_venta >= DATE_SUB(CURDATE(), INTERVAL 7 DAY)
-                ORDER BY v.total_con_iva DESC
-                LIMIT 1
             ''')
             best_sale = cursor.fetchone()
 
@@ -1067,18 +1552,25 @@ def get_best_seller_of_month():
     connection = get_db_connection()
     try:
         with connection.cursor() as cursor:
+            # Se suman los resúmenes diarios del mes en curso (rango sobre la clave primaria)
             cursor.execute('''
                 SELECT 
                     CONCAT(u.nombre, ' ', u.apellido) as vendedor,
-                    SUM(v.total_con_iva) as total_ventas,
-                    COUNT(v.id_venta) as numero_ventas
-                FROM VENTA v
-                INNER JOIN USUARIOS u ON v.id_cajero = u.id_usuario
-                WHERE MONTH(v.fecha_venta) = MONTH(CURRENT_DATE())
-                    AND YEAR(v.fecha_venta) = YEAR(CURRENT_DATE())
-                GROUP BY v.id_cajero
-                ORDER BY total_ventas DESC
-                LIMIT 1
+                    r.total_ventas,
+                    r.numero_ventas
+                FROM (
+                    SELECT 
+                        id_cajero,
+                        SUM(total_ventas) as total_ventas,
+                        CAST(SUM(numero_ventas) AS UNSIGNED) as numero_ventas
+                    FROM RESUMENVENTACAJERO
+                    WHERE fecha >= CURDATE() - INTERVAL (DAYOFMONTH(CURDATE()) - 1) DAY
+                        AND fecha <= LAST_DAY(CURDATE())
+                    GROUP BY id_cajero
+                    ORDER BY total_ventas DESC
+                    LIMIT 1
+                ) r
+                INNER JOIN USUARIOS u ON r.id_cajero = u.id_usuario
             ''')
             best_seller = cursor.fetchone()
 
@@ -1099,11 +1591,12 @@ def get_best_seller_of_month():
 # Ruta para obtener todas las compras y los productos asociados
 @app.route('/compras', methods=['GET'])
 def get_all_compras():
+    page = get_page()
     connection = get_db_connection()
     try:
         with connection.cursor() as cursor:
             # Obtener todas las compras
-            cursor.execute('''
+            query, params = paginate_query('''
                 SELECT 
                     c.id_compra,
                     c.fecha_compra,
@@ -1113,28 +1606,32 @@ def get_all_compras():
                     CONCAT(u.nombre, ' ', u.apellido) AS proveedor
                 FROM COMPRA c
                 INNER JOIN USUARIOS u ON c.id_proveedor = u.id_usuario
-            ''')
+            ''', [], [], page, ['c.id_compra'])
+            cursor.execute(query, params)
             compras = cursor.fetchall()
 
-            # Obtener los productos
+            # Obtener los productos de todas las compras en lotes
+            detalles = fetch_in_chunks(cursor, '''
+                SELECT 
+                    dc.id_compra,
+                    dc.cantidad,
+                    p.nombre AS producto_nombre,
+                    p.descripcion
+                FROM DETALLECOMPRA dc
+                INNER JOIN PRODUCTOS p ON dc.id_producto = p.id_producto
+                WHERE dc.id_compra IN ({placeholders})
+            ''', [compra['id_compra'] for compra in compras])
+            productos_por_compra = group_rows_by(detalles, 'id_compra')
+
             resultado = []
             for compra in compras:
-                cursor.execute('''
-                    SELECT 
-                        dc.cantidad,
-                        p.nombre AS producto_nombre,
-                        p.descripcion
-                    FROM DETALLECOMPRA dc
-                    INNER JOIN PRODUCTOS p ON dc.id_producto = p.id_producto
-                    WHERE dc.id_compra = %s
-                ''', (compra['id_compra'],))
-                productos = cursor.fetchall()
-
                 resultado.append({
                     "compra": compra,
-                    "productos": productos
+                    "productos": productos_por_compra.get(compra['id_compra'], [])
                 })
 
+        if page:
+            return jsonify(page.result(resultado, lambda item: [item['compra']['id_compra']])), 200
         return jsonify(resultado), 200
     except Exception as e:
         print(f"Error al obtener las compras: {e}")
@@ -1162,6 +1659,11 @@ def add_compra_with_details():
     if not productos or not isinstance(productos, list) or len(productos) == 0:
         return jsonify({"msg": "Se requiere al menos un producto para registrar la compra"}), 400
 
+    # Validar los productos antes de abrir la transacción
+    detalles = leer_detalles_productos(productos)
+    if detalles is None:
+        return jsonify({"msg": "Cada producto debe incluir id_producto y cantidad"}), 400
+
     connection = get_db_connection()
     try:
         with connection.cursor() as cursor:
@@ -1181,21 +1683,21 @@ def add_compra_with_details():
             # Obtener el ID de la compra recién insertada
             id_compra = cursor.lastrowid
 
-            # Insertar los productos en DETALLECOMPRA
-            for producto in productos:
-                id_producto = producto.get('id_producto')
-                cantidad = producto.get('cantidad')
-
-                if not all([id_producto, cantidad]):
-                    return jsonify({"msg": "Cada producto debe incluir id_producto y cantidad"}), 400
+            # Insertar los productos en DETALLECOMPRA con una sola sentencia, una fila por producto
+            cantidades = sumar_cantidades(detalles)
+            cursor.executemany('''
+                INSERT INTO DETALLECOMPRA (id_compra, id_producto, cantidad)
+                VALUES (%s, %s, %s)
+            ''', [(id_compra, id_producto, cantidades[id_producto]) for id_producto in sorted(cantidades)])
 
-                cursor.execute('''
-                    INSERT INTO DETALLECOMPRA (id_compra, id_producto, cantidad)
-                    VALUES (%s, %s, %s)
-                ''', (id_compra, id_producto, cantidad))
+            # Sumar al stock lo comprado en la misma transacción
+            reponer_stock(cursor, cantidades)
 
+            product_changes.registrar(cursor, {id_producto for id_producto, _ in detalles})
             connection.commit()
 
+        invalidar_productos({id_producto for id_producto, _ in detalles})
+
         return jsonify({"msg": "Compra y detalles registrados exitosamente", "id_compra": id_compra}), 201
     except Exception as e:
         print(f"Error al registrar la compra: {e}")
@@ -1209,6 +1711,12 @@ def add_compra_with_details():
 #    Sección boleta     #
 #########################
 
+# Reemplaza los ids de forma de pago y tipo de documento por sus nombres
+def resolver_referencias_venta(venta):
+    venta['forma_pago'] = referencias.get_name('forma_pago', venta.pop('id_forma_pago'))
+    venta['tipo_documento'] = referencias.get_name('tipo_documento', venta.pop('id_tipodocumento'))
+    return venta
+
 # Ruta para obtener los datos completos de una boleta
 @app.route('/boleta/<int:id_venta>', methods=['GET'])
 def get_boleta(id_venta):
@@ -1225,8 +1733,8 @@ def get_boleta(id_venta):
                     v.porcentaje,
                     (SELECT CONCAT(nombre, ' ', apellido) FROM USUARIOS WHERE id_usuario = v.id_cliente) AS cliente,
                     (SELECT CONCAT(nombre, ' ', apellido) FROM USUARIOS WHERE id_usuario = v.id_cajero) AS cajero,
-                    (SELECT metodo FROM FORMAPAGO WHERE id_forma_pago = v.id_forma_pago) AS forma_pago,
-                    (SELECT nombre FROM TIPODOCUMENTO WHERE id_tipodocumento = v.id_tipodocumento) AS tipo_documento
+                    v.id_forma_pago,
+                    v.id_tipodocumento
                 FROM VENTA v
                 WHERE v.id_venta = %s
             ''', (id_venta,))
@@ -1235,6 +1743,8 @@ def get_boleta(id_venta):
             if not venta:
                 return jsonify({"msg": "Venta no encontrada"}), 404
 
+            resolver_referencias_venta(venta)
+
             # Obtener detalles de productos en la venta
             cursor.execute('''
                 SELECT 
@@ -1258,14 +1768,59 @@ def get_boleta(id_venta):
     finally:
         connection.close()
 
+# Agrupar las filas de venta + detalle (ordenadas por venta) en boletas
+def agrupar_boletas(rows):
+    boleta = None
+    for row in rows:
+        detalle = {
+            "cantidad": row.pop('detalle_cantidad'),
+            "nombre": row.pop('detalle_nombre'),
+            "descripcion": row.pop('detalle_descripcion'),
+            "fecha_vencimiento": row.pop('detalle_fecha_vencimiento'),
+        }
+        if boleta is None or boleta["venta"]['id_venta'] != row['id_venta']:
+            if boleta is not None:
+                yield boleta
+            boleta = {"venta": resolver_referencias_venta(row), "productos": []}
+        if detalle["nombre"] is not None:
+            boleta["productos"].append(detalle)
+    if boleta is not None:
+        yield boleta
+
 # Ruta para obtener los detalles de todas las boletas
 @app.route('/boletas', methods=['GET'])
 def get_all_boletas():
+    export_format = get_export_format()
+    if export_format:
+        # Exportación completa en streaming: una sola consulta ordenada por venta
+        return stream_query('''
+            SELECT 
+                v.id_venta,
+                v.fecha_venta,
+                v.total_sin_iva,
+                v.total_con_iva,
+                v.numero_documento,
+                v.porcentaje,
+                (SELECT CONCAT(nombre, ' ', apellido) FROM USUARIOS WHERE id_usuario = v.id_cliente) AS cliente,
+                (SELECT CONCAT(nombre, ' ', apellido) FROM USUARIOS WHERE id_usuario = v.id_cajero) AS cajero,
+                v.id_forma_pago,
+                v.id_tipodocumento,
+                dv.cantidad AS detalle_cantidad,
+                p.nombre AS detalle_nombre,
+                p.descripcion AS detalle_descripcion,
+                p.fecha_vencimiento AS detalle_fecha_vencimiento
+            FROM VENTA v
+            LEFT JOIN (DETALLEVENTA dv INNER JOIN PRODUCTOS p ON dv.id_producto = p.id_producto)
+                ON dv.id_venta = v.id_venta
+            ORDER BY v.id_venta
+        ''', [], export_format, transform=agrupar_boletas)
+
+    page = get_page()
     connection = get_db_connection()
     try:
         with connection.cursor() as cursor:
             # Obtener todas las ventas con datos de cliente, cajero, forma de pago y tipo de documento
-            cursor.execute('''
+            query, params = paginate_query('''
                 SELECT 
                     v.id_venta,
                     v.fecha_venta,
@@ -1275,33 +1830,38 @@ def get_all_boletas():
                     v.porcentaje,
                     (SELECT CONCAT(nombre, ' ', apellido) FROM USUARIOS WHERE id_usuario = v.id_cliente) AS cliente,
                     (SELECT CONCAT(nombre, ' ', apellido) FROM USUARIOS WHERE id_usuario = v.id_cajero) AS cajero,
-                    (SELECT metodo FROM FORMAPAGO WHERE id_forma_pago = v.id_forma_pago) AS forma_pago,
-                    (SELECT nombre FROM TIPODOCUMENTO WHERE id_tipodocumento = v.id_tipodocumento) AS tipo_documento
+                    v.id_forma_pago,
+                    v.id_tipodocumento
                 FROM VENTA v
-            ''')
+            ''', [], [], page, ['v.id_venta'])
+            cursor.execute(query, params)
             ventas = cursor.fetchall()
 
-            # Para cada venta, obtener los detalles de los productos referentes a esa venta
+            # Obtener los detalles de los productos de todas las ventas en lotes
+            detalles = fetch_in_chunks(cursor, '''
+                SELECT 
+                    dv.id_venta,
+                    dv.cantidad,
+                    p.nombre,
+                    p.descripcion,
+                    p.fecha_vencimiento
+                FROM DETALLEVENTA dv
+                INNER JOIN PRODUCTOS p ON dv.id_producto = p.id_producto
+                WHERE dv.id_venta IN ({placeholders})
+            ''', [venta['id_venta'] for venta in ventas])
+            productos_por_venta = group_rows_by(detalles, 'id_venta')
+
             boletas = []
             for venta in ventas:
-                cursor.execute('''
-                    SELECT 
-                        dv.cantidad,
-                        p.nombre,
-                        p.descripcion,
-                        p.fecha_vencimiento
-                    FROM DETALLEVENTA dv
-                    INNER JOIN PRODUCTOS p ON dv.id_producto = p.id_producto
-                    WHERE dv.id_venta = %s
-                ''', (venta['id_venta'],))
-                productos = cursor.fetchall()
-
+                resolver_referencias_venta(venta)
                 boleta = {
                     "venta": venta,
-                    "productos": productos
+                    "productos": productos_por_venta.get(venta['id_venta'], [])
                 }
                 boletas.append(boleta)
 
+        if page:
+            return jsonify(page.result(boletas, lambda boleta: [boleta['venta']['id_venta']])), 200
         return jsonify(boletas), 200
     finally:
         connection.close()
@@ -1310,18 +1870,72 @@ def get_all_boletas():
 #    Sección Websocket     #
 ############################
 
+# Miembros y entregas por sala
+room_metrics = RoomMetrics()
+
+# Incluir el producto en los eventos de escaneo y ventana para descartar escaneos
+# duplicados (solo en los escaneos que incluyen el producto)
+SCAN_INCLUIR_PRODUCTO = os.getenv('SCAN_INCLUIR_PRODUCTO', 'false').lower() == 'true'
+scan_coalescer = ScanCoalescer(window=int(os.getenv('SCAN_COALESCE_MS', 250)) / 1000)
+
+# RUT autenticado con el token de cada conexión (sid -> rut). Los eventos solo pueden
+# dirigirse a la sala de ese RUT.
+ruts_por_sid = {}
+
+# Indica si la conexión actual puede enviar eventos a la sala de `rut`
+def rut_autorizado(rut):
+    autenticado = ruts_por_sid.get(request.sid)
+    if autenticado is None or str(rut) != autenticado:
+        print(f"Evento rechazado: la conexión {request.sid} no está autenticada para el rut {rut}")
+        return False
+    return True
+
+# Emitir un evento solo a los clientes de la sala de un RUT
+def emitir_a_rut(rut, evento, datos):
+    sala = sala_rut(rut)
+    room_metrics.record_emit(sala)
+    socketio.emit(evento, datos, to=sala)
+
+# Al conectarse, un cliente que envía su token JWT (auth={'token': ...} o ?token=)
+# se une a la sala de su RUT. Un token inválido rechaza la conexión.
 @socketio.on('connect')
-def handle_connect():
-    print('Cliente conectado')
+def handle_connect(auth=None):
+    token = (auth or {}).get('token') if isinstance(auth, dict) else None
+    token = token or request.args.get('token')
+
+    if token:
+        try:
+            identity = decode_token(token)['sub']
+        except Exception as e:
+            print(f"Conexión rechazada, token inválido: {e}")
+            return False
+
+        rut = identity.get('rut') if isinstance(identity, dict) else identity
+        ruts_por_sid[request.sid] = str(rut)
+        join_room(sala_rut(rut))
+        room_metrics.join(request.sid, sala_rut(rut))
+        print(f'Cliente conectado a la sala del rut {rut}')
+    else:
+        print('Cliente conectado')
 
 @socketio.on('disconnect')
 def handle_disconnect():
+    ruts_por_sid.pop(request.sid, None)
+    room_metrics.leave_all(request.sid)
     print('Cliente desconectado')
 
 @socketio.on('scan_request')
 def handle_scan_request(data):
     print('Petición de escaneo recibida por parte de:', data)
-    socketio.emit('scan_response', {'message': 'Escaneo iniciado'})
+    rut = data.get('rut') if isinstance(data, dict) else None
+
+    # Responder a la sala del RUT indicado, o solo al cliente que hizo la petición
+    if rut:
+        if not rut_autorizado(rut):
+            return
+        emitir_a_rut(rut, 'scan_response', {'message': 'Escaneo iniciado'})
+    else:
+        socketio.emit('scan_response', {'message': 'Escaneo iniciado'}, to=request.sid)
 
 @socketio.on('barcode_scanned')
 def handle_barcode_scanned(data):
@@ -1330,30 +1944,132 @@ def handle_barcode_scanned(data):
 
     if not barcode or not rut:
         return
+    if not rut_autorizado(rut):
+        return
 
     print(f"Código de barras recibido para el rut {rut}: {barcode}")
 
-    # Emitir solo a los clientes conectados que tengan el rut específico
-    socketio.emit(f'barcode_update_{rut}', {'barcode': barcode})
+    payload = {'barcode': barcode}
+
+    # Resolver el producto en el servidor para que la caja no tenga que pedirlo por HTTP.
+    # Los escaneos repetidos se descartan solo aquí, para no resolver el mismo producto
+    # varias veces; sin incluir_producto cada escaneo se reenvía como antes.
+    if data.get('incluir_producto', SCAN_INCLUIR_PRODUCTO):
+        if not scan_coalescer.accept(rut, barcode):
+            return
+        try:
+            product = fetch_product_by_barcode(str(barcode))
+            # Convertir fechas y decimales igual que las respuestas HTTP
+            payload['producto'] = json.loads(app.json.dumps(product)) if product else None
+        except Exception as e:
+            print(f"Error al obtener el producto escaneado {barcode}: {e}")
+            payload['producto'] = None
+
+    # Emitir solo a los clientes conectados a la sala del rut específico
+    emitir_a_rut(rut, f'barcode_update_{rut}', payload)
 
 
 ############################
 #    Sección registros     #
 ############################
 
-# Ruta para obtener todos los registros
+# Leer una fecha de filtro (AAAA-MM-DD o AAAA-MM-DD HH:MM[:SS]).
+# Devuelve la fecha y si se indicó solo el día, o (None, False) si no es válida.
+def leer_fecha_filtro(valor):
+    for formato in ('%Y-%m-%d %H:%M:%S', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%dT%H:%M', '%Y-%m-%d'):
+        try:
+            return datetime.strptime(valor, formato), formato == '%Y-%m-%d'
+        except ValueError:
+            continue
+    return None, False
+
+# Construir las condiciones de los filtros de /registros. Devuelve (condiciones, parámetros, error).
+# Las columnas filtradas tienen índices (ver migrations/004_indices_registros.sql).
+def filtros_registros():
+    conditions = []
+    params = []
+
+    usuario = request.args.get('usuario')
+    if usuario:
+        conditions.append('usuario = %s')
+        params.append(usuario)
+
+    tipo = request.args.get('tipo')
+    if tipo:
+        conditions.append('tipo = %s')
+        params.append(tipo)
+
+    # Rango semiabierto sobre fecha_y_hora; una fecha_fin sin hora incluye todo ese día
+    fecha_inicio = request.args.get('fecha_inicio')
+    if fecha_inicio:
+        desde, _ = leer_fecha_filtro(fecha_inicio)
+        if desde is None:
+            return None, None, "fecha_inicio no es una fecha válida"
+        conditions.append('fecha_y_hora >= %s')
+        params.append(desde)
+
+    fecha_fin = request.args.get('fecha_fin')
+    if fecha_fin:
+        hasta, solo_dia = leer_fecha_filtro(fecha_fin)
+        if hasta is None:
+            return None, None, "fecha_fin no es una fecha válida"
+        if solo_dia:
+            conditions.append('fecha_y_hora < %s')
+            params.append(hasta + timedelta(days=1))
+        else:
+            conditions.append('fecha_y_hora <= %s')
+            params.append(hasta)
+
+    # Búsqueda de texto en mensaje y descripción con el índice FULLTEXT. Se usan solo las
+    # palabras (sin operadores del modo booleano) y todas deben aparecer, como prefijo.
+    texto = request.args.get('q')
+    if texto:
+        palabras = re.findall(r'\w+', texto)
+        if not palabras:
+            return None, None, "La búsqueda no contiene palabras"
+        conditions.append('MATCH (mensaje, descripcion) AGAINST (%s IN BOOLEAN MODE)')
+        params.append(' '.join(f'+{palabra}*' for palabra in palabras))
+
+    return conditions, params, None
+
+# Ruta para obtener los registros, con filtros opcionales por usuario, tipo,
+# rango de fecha_inicio/fecha_fin y texto (q)
 @app.route('/registros', methods=['GET'])
 def get_all_registros():
+    conditions, params, error = filtros_registros()
+    if error:
+        return jsonify({"msg": error}), 400
+
+    # Con filtros el orden es por fecha, para recorrer solo el rango de los índices
+    # (usuario, fecha_y_hora) y (tipo, fecha_y_hora); sin filtros se mantiene el orden por id
+    if conditions:
+        columns = ['fecha_y_hora', 'id_registro']
+        key = lambda registro: [str(registro['fecha_y_hora']), registro['id_registro']]
+    else:
+        columns = ['id_registro']
+        key = lambda registro: [registro['id_registro']]
+
+    query = '''
+        SELECT id_registro, mensaje, fecha_y_hora, tipo, descripcion, usuario
+        FROM REGISTROHISTORIAL
+    '''
+
+    export_format = get_export_format()
+    if export_format:
+        # Exportación completa en streaming
+        query, params = paginate_query(query, conditions, params, None, [])
+        return stream_query(query + ' ORDER BY ' + ', '.join(columns), params, export_format)
+
+    page = get_page()
+    query, params = paginate_query(query, conditions, params, page, columns)
     connection = get_db_connection()
     try:
         with connection.cursor() as cursor:
-            # Consulta para obtener todos los registros de REGISTROHISTORIAL
-            cursor.execute('''
-                SELECT id_registro, mensaje, fecha_y_hora, tipo, descripcion, usuario
-                FROM REGISTROHISTORIAL
-            ''')
+            cursor.execute(query, params)
             registros = cursor.fetchall()
 
+        if page:
+            return jsonify(page.result(registros, key)), 200
         return jsonify(registros), 200
     except Exception as e:
         print(f"Error al obtener los registros: {e}")
@@ -1361,10 +2077,42 @@ def get_all_registros():
     finally:
         connection.close()
 
-# Ruta para insertar un nuevo registro
-@app.route('/registros', methods=['POST'])
-def add_registro():
-    data = request.json
+# Leer el rango fecha_inicio/fecha_fin de la solicitud como [desde, hasta).
+# Devuelve (desde, hasta, error); una fecha_fin sin hora incluye todo ese día.
+def rango_fechas_archivo():
+    desde = hasta = None
+    if request.args.get('fecha_inicio'):
+        desde, _ = leer_fecha_filtro(request.args['fecha_inicio'])
+        if desde is None:
+            return None, None, "fecha_inicio no es una fecha válida"
+    if request.args.get('fecha_fin'):
+        hasta, solo_dia = leer_fecha_filtro(request.args['fecha_fin'])
+        if hasta is None:
+            return None, None, "fecha_fin no es una fecha válida"
+        hasta += timedelta(days=1) if solo_dia else timedelta(seconds=1)
+    return desde, hasta, None
+
+# Ruta para consultar los registros archivados por la retención, con los filtros
+# usuario, tipo, fecha_inicio y fecha_fin. Las fechas se devuelven en formato ISO.
+@app.route('/archivo/registros', methods=['GET'])
+def get_archived_registros():
+    desde, hasta, error = rango_fechas_archivo()
+    if error:
+        return jsonify({"msg": error}), 400
+
+    usuario = request.args.get('usuario')
+    tipo = request.args.get('tipo')
+    def filtro(registro):
+        return (not usuario or registro['usuario'] == usuario) and (not tipo or registro['tipo'] == tipo)
+
+    return stream_items(retention.leer('registros', desde, hasta, filtro), get_export_format() or 'json')
+
+
+# Validar un registro recibido. Devuelve (registro, None) o (None, mensaje de error).
+def validar_registro(data):
+    if not isinstance(data, dict):
+        return None, "Formato de registro inválido"
+
     mensaje = data.get('mensaje')
     fecha_y_hora = data.get('fecha_y_hora')
     tipo = data.get('tipo')
@@ -1373,55 +2121,225 @@ def add_registro():
 
     # Validar que los campos obligatorios estén presentes
     if not all([mensaje, fecha_y_hora, tipo, usuario]):
-        return jsonify({"msg": "Faltan datos obligatorios"}), 400
+        return None, "Faltan datos obligatorios"
+
+    return (mensaje, fecha_y_hora, tipo, descripcion, usuario), None
+
+# Ruta para insertar un registro, o varios si se envía un arreglo. Los registros se
+# encolan y se guardan en lotes en segundo plano, por lo que la respuesta es 202.
+@app.route('/registros', methods=['POST'])
+def add_registro():
+    data = request.json
+
+    if isinstance(data, list):
+        if not data:
+            return jsonify({"msg": "No se recibieron registros"}), 400
+
+        registros = []
+        errores = []
+        for indice, item in enumerate(data, start=1):
+            registro, error = validar_registro(item)
+            if error:
+                errores.append({"indice": indice, "error": error})
+            else:
+                registros.append(registro)
+
+        # Se aceptan todos los registros o ninguno
+        if errores:
+            return jsonify({"msg": "Hay registros inválidos", "errores": errores}), 400
+    else:
+        registro, error = validar_registro(data)
+        if error:
+            return jsonify({"msg": error}), 400
+        registros = [registro]
 
-    connection = get_db_connection()
     try:
-        with connection.cursor() as cursor:
-            # Insertar un nuevo registro en REGISTROHISTORIAL
-            cursor.execute('''
-                INSERT INTO REGISTROHISTORIAL (mensaje, fecha_y_hora, tipo, descripcion, usuario)
-                VALUES (%s, %s, %s, %s, %s)
-            ''', (mensaje, fecha_y_hora, tipo, descripcion, usuario))
-            connection.commit()
+        audit_writer.submit(registros)
+    except ValueError as e:
+        return jsonify({"msg": str(e)}), 400
+    except AuditQueueFullError as e:
+        print(f"Registros rechazados: {e}")
+        return jsonify({"msg": "Servidor ocupado, intente nuevamente"}), 503, {"Retry-After": "1"}
 
-        return jsonify({"msg": "Registro agregado exitosamente"}), 201
-    except Exception as e:
-        print(f"Error al insertar el registro: {e}")
-        return jsonify({"msg": "Ocurrió un error al insertar el registro"}), 500
+    if isinstance(data, list):
+        return jsonify({"msg": "Registros recibidos", "total": len(registros)}), 202
+    return jsonify({"msg": "Registro recibido"}), 202
+
+
+############################
+#    Sección monitoreo     #
+############################
+
+# Ruta para consultar el estado del pool de conexiones
+@app.route('/db/pool-stats', methods=['GET'])
+def get_db_pool_stats():
+    return jsonify(get_pool_stats()), 200
+
+# Ruta para consultar las salas de Socket.IO y las entregas por sala
+@app.route('/socket/stats', methods=['GET'])
+def get_socket_stats():
+    stats = room_metrics.stats()
+    stats['escaneos_descartados'] = scan_coalescer.coalesced
+    return jsonify(stats), 200
+
+# Ruta para consultar los contadores de la caché de productos
+@app.route('/cache/stats', methods=['GET'])
+def get_cache_stats():
+    return jsonify({"productos": product_cache.stats(), "perfiles": profile_cache.stats()}), 200
+
+# Ruta para consultar la cola de escritura de registros
+@app.route('/registros/stats', methods=['GET'])
+def get_registros_stats():
+    return jsonify(audit_writer.stats()), 200
+
+# Ruta para consultar los tiempos del hash de contraseñas
+@app.route('/auth/hash-stats', methods=['GET'])
+def get_hash_stats():
+    return jsonify(passwords.stats()), 200
+
+
+# Comando para recalcular los resúmenes de ventas: flask --app app reconstruir-resumen-ventas
+@app.cli.command('reconstruir-resumen-ventas')
+@click.option('--desde', default=None, help='Recalcular solo desde esta fecha (AAAA-MM-DD)')
+def reconstruir_resumen_ventas(desde):
+    connection = get_db_connection()
+    try:
+        filas_cajero, filas_cliente = sales_summary.reconstruir(connection, desde)
+        print(f"Resúmenes reconstruidos: {filas_cajero} filas por cajero, {filas_cliente} filas por cliente")
     finally:
         connection.close()
 
 
+# Comando para archivar el historial antiguo ahora: flask --app app archivar-historial
+@app.cli.command('archivar-historial')
+def archivar_historial():
+    resultado = retention.ejecutar(get_db_connection)
+    if resultado:
+        print(f"Archivados {resultado['registros']} registros y {resultado['ventas']} ventas en {retention.ARCHIVE_DIR}")
+
+
 #########################################################
 #    Sección verificación periódica de vencimientos     #
 #########################################################
 
-# Función para eliminar descuentos vencidos
+# Hora diaria (HH:MM) de la eliminación de descuentos vencidos y tamaño de cada lote
+DESCUENTOS_HORA = os.getenv('DISCOUNT_EXPIRY_TIME', '00:05')
+DESCUENTOS_LOTE = int(os.getenv('DISCOUNT_EXPIRY_BATCH_SIZE', 500))
+# Ejecutar también al iniciar, por si el servidor estuvo detenido a la hora programada
+DESCUENTOS_AL_INICIAR = os.getenv('DISCOUNT_EXPIRY_ON_START', '1') == '1'
+
+# Resultado de la última ejecución en este proceso (GET /tareas/descuentos-vencidos)
+ultima_eliminacion_descuentos = {}
+
+# Función para eliminar descuentos vencidos. Borra en lotes cortos para no bloquear
+# DESCUENTOS por mucho tiempo, y con varios workers solo la ejecuta el que obtiene
+# el bloqueo. Volver a ejecutarla no tiene efecto si no hay nuevos vencimientos.
 def eliminar_descuentos_vencidos():
+    hoy = datetime.now().date()
+    inicio = time.monotonic()
+    eliminados = 0
+    lotes = 0
     connection = get_db_connection()
     try:
-        with connection.cursor() as cursor:
-            # Borrar los descuentos cuya fecha de vencimiento es anterior a la fecha actual
-            cursor.execute('''
-                DELETE FROM DESCUENTOS
-                WHERE vencimiento_descuento < %s
-            ''', (datetime.now().date(),))
-            connection.commit()
-            print(f"Descuentos vencidos eliminados exitosamente a las {datetime.now()}")
+        with leader_lock(connection, 'sellify_descuentos_vencidos') as lider:
+            if not lider:
+                print("La eliminación de descuentos vencidos ya se está ejecutando en otro proceso")
+                return
+
+            ultimo = None
+            while True:
+                with connection.cursor() as cursor:
+                    # Bloquear un lote de descuentos vencidos en el orden del índice
+                    # idx_descuentos_vencimiento, continuando después del último lote,
+                    # para que la lectura se detenga en el límite y solo bloquee esas filas
+                    condicion, params = Page(DESCUENTOS_LOTE, ultimo).keyset_condition(
+                        ['vencimiento_descuento', 'id_producto'])
+                    cursor.execute(f'''
+                        SELECT vencimiento_descuento, id_producto FROM DESCUENTOS
+                        WHERE vencimiento_descuento < %s{' AND ' + condicion if condicion else ''}
+                        ORDER BY vencimiento_descuento, id_producto
+                        LIMIT %s
+                        FOR UPDATE
+                    ''', (hoy, *params, DESCUENTOS_LOTE))
+                    filas = cursor.fetchall()
+                    if not filas:
+                        break
+
+                    # Borrar exactamente los descuentos vencidos del lote
+                    claves = [(fila['vencimiento_descuento'], fila['id_producto']) for fila in filas]
+                    cursor.execute(f'''
+                        DELETE FROM DESCUENTOS
+                        WHERE (vencimiento_descuento, id_producto) IN ({', '.join(['(%s, %s)'] * len(claves))})
+                    ''', [valor for clave in claves for valor in clave])
+                    eliminados += cursor.rowcount
+                    ids_producto = sorted({fila['id_producto'] for fila in filas})
+                    product_changes.registrar(cursor, ids_producto)
+                connection.commit()
+                lotes += 1
+                ultimo = list(claves[-1])
+
+                # Los descuentos eliminados dejan desactualizados los productos en caché;
+                # los clientes conectados reciben los productos afectados para refrescar sus precios
+                invalidar_productos(ids_producto)
+                socketio.emit('descuentos_vencidos', {'ids_producto': ids_producto})
+
+                if len(filas) < DESCUENTOS_LOTE:
+                    break
+
+        duracion = time.monotonic() - inicio
+        ultima_eliminacion_descuentos.update({
+            'fecha': datetime.now().isoformat(timespec='seconds'),
+            'eliminados': eliminados,
+            'lotes': lotes,
+            'duracion': round(duracion, 3),
+        })
+        print(f"Descuentos vencidos eliminados: {eliminados} en {lotes} lotes ({duracion:.2f} s) a las {datetime.now()}")
     except Exception as e:
+        connection.rollback()
         print(f"Error al eliminar los descuentos vencidos: {e}")
     finally:
         connection.close()
 
+# Ruta para consultar la última eliminación de descuentos vencidos hecha por este proceso
+@app.route('/tareas/descuentos-vencidos', methods=['GET'])
+def get_discount_expiry_status():
+    return jsonify(ultima_eliminacion_descuentos), 200
+
 # Configuración de la programación
 scheduler = BackgroundScheduler()
-scheduler.add_job(func=eliminar_descuentos_vencidos, trigger="interval", hours=24)
+hora, minuto = DESCUENTOS_HORA.split(':')
+# next_run_time=None dejaría la tarea en pausa, por eso solo se indica si se ejecuta al iniciar
+primera_ejecucion = {'next_run_time': datetime.now()} if DESCUENTOS_AL_INICIAR else {}
+scheduler.add_job(
+    func=eliminar_descuentos_vencidos,
+    trigger="cron",
+    hour=int(hora),
+    minute=int(minuto),
+    coalesce=True,
+    misfire_grace_time=3600,
+    **primera_ejecucion
+)
+# Retención del historial (desactivada por defecto, ver RETENTION_ENABLED)
+if retention.RETENTION_ENABLED:
+    hora, minuto = retention.RETENTION_TIME.split(':')
+    scheduler.add_job(func=retention.ejecutar, args=[get_db_connection], trigger="cron", hour=int(hora), minute=int(minuto))
 scheduler.start()
 
+# Abrir las conexiones mínimas del pool y cargar las tablas de referencia al iniciar
+try:
+    get_pool().fill()
+    referencias.load_all()
+except Exception as e:
+    print(f"No se pudo inicializar la conexión a la base de datos: {e}")
+
 # Código para evitar que el programador continúe ejecutándose
 import atexit
 atexit.register(lambda: scheduler.shutdown(wait=False))
+atexit.register(lambda: get_pool().close_all())
+atexit.register(passwords.shutdown)
+# Se registra después del pool para ejecutarse antes que su cierre: los registros en cola se guardan
+atexit.register(audit_writer.stop)
 
+# Servidor de desarrollo. En producción usar wsgi.py (ver README)
 if __name__ == '__main__':
     socketio.run(app, debug=True)
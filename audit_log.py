@@ -0,0 +1,214 @@
+import os
+import threading
+import time
+from collections import deque
+import pymysql
+from db_pool import PoolTimeoutError
+
+AUDIT_QUEUE_SIZE = int(os.getenv('AUDIT_QUEUE_SIZE', 10000))
+AUDIT_BATCH_SIZE = int(os.getenv('AUDIT_BATCH_SIZE', 500))
+AUDIT_FLUSH_INTERVAL = float(os.getenv('AUDIT_FLUSH_INTERVAL', 1))
+# Segundos que una solicitud espera lugar en la cola llena antes de rechazarse
+AUDIT_PUT_TIMEOUT = float(os.getenv('AUDIT_PUT_TIMEOUT', 2))
+AUDIT_RETRY_DELAY_MAX = 30
+
+COLUMNS = ('mensaje', 'fecha_y_hora', 'tipo', 'descripcion', 'usuario')
+
+# Errores de conexión: el lote se conserva y se reintenta más tarde
+_CONNECTION_ERRORS = {2003, 2006, 2013, 2055}
+
+
+class AuditQueueFullError(Exception):
+    pass
+
+
+def _is_connection_error(e):
+    if isinstance(e, PoolTimeoutError):
+        return True
+    return isinstance(e, pymysql.err.OperationalError) and e.args and e.args[0] in _CONNECTION_ERRORS
+
+
+# Escritor de REGISTROHISTORIAL en segundo plano. Los registros se acumulan en
+# una cola acotada y un hilo los inserta en lotes cuando se juntan `batch_size`
+# o pasan `flush_interval` segundos desde el primero en espera.
+class AuditWriter:
+    def __init__(self, get_connection, max_queue=AUDIT_QUEUE_SIZE, batch_size=AUDIT_BATCH_SIZE,
+                 flush_interval=AUDIT_FLUSH_INTERVAL, put_timeout=AUDIT_PUT_TIMEOUT):
+        self._get_connection = get_connection
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+
+        self._cond = threading.Condition()
+        self._queue = deque()
+        self._oldest = None  # momento en que llegó el registro más antiguo en espera
+        self._writing = 0
+        self._stopping = False
+        self._thread = None
+        self._pid = None
+
+        self.written = 0
+        self.batches = 0
+        self.failed = 0
+        self.rejected = 0
+        self.retries = 0
+
+    # El hilo se crea en el proceso que escribe (los workers se crean con fork)
+    def _ensure_thread(self):
+        if self._thread is None or self._pid != os.getpid():
+            self._queue.clear()
+            self._oldest = None
+            self._writing = 0
+            self._thread = threading.Thread(target=self._run, name='audit-writer', daemon=True)
+            self._pid = os.getpid()
+            self._thread.start()
+
+    # Encolar registros (tuplas en el orden de COLUMNS). Se encolan todos o ninguno;
+    # si la cola sigue llena después de `put_timeout` se lanza AuditQueueFullError.
+    def submit(self, registros):
+        registros = list(registros)
+        if len(registros) > self.max_queue:
+            raise ValueError(f'Se permiten como máximo {self.max_queue} registros por envío')
+
+        with self._cond:
+            if self._stopping:
+                raise AuditQueueFullError('El registro de auditoría se está cerrando')
+            self._ensure_thread()
+
+            deadline = time.monotonic() + self.put_timeout
+            while len(self._queue) + len(registros) > self.max_queue:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.rejected += len(registros)
+                    raise AuditQueueFullError('La cola de registros está llena')
+                self._cond.wait(remaining)
+
+            if not self._queue:
+                self._oldest = time.monotonic()
+            self._queue.extend(registros)
+            if len(self._queue) >= self.batch_size:
+                self._cond.notify_all()
+
+    def _take_batch(self):
+        with self._cond:
+            while True:
+                if self._queue:
+                    due = self._oldest + self.flush_interval
+                    if self._stopping or len(self._queue) >= self.batch_size or time.monotonic() >= due:
+                        break
+                    self._cond.wait(due - time.monotonic())
+                elif self._stopping:
+                    return None
+                else:
+                    self._cond.wait()
+
+            count = min(self.batch_size, len(self._queue))
+            batch = [self._queue.popleft() for _ in range(count)]
+            self._oldest = time.monotonic() if self._queue else None
+            self._writing += 1
+            # Hay lugar en la cola para las solicitudes que esperaban
+            self._cond.notify_all()
+            return batch
+
+    def _requeue(self, batch):
+        with self._cond:
+            self._queue.extendleft(reversed(batch))
+            self._oldest = time.monotonic()
+
+    def _run(self):
+        delay = 1
+        while True:
+            batch = self._take_batch()
+            if batch is None:
+                return
+            try:
+                self._write(batch)
+                delay = 1
+            except Exception as e:
+                if _is_connection_error(e) and not self._stopping:
+                    # Base de datos no disponible: conservar el lote y reintentar más tarde
+                    print(f"No se pudieron guardar {len(batch)} registros, se reintenta en {delay} s: {e}")
+                    self.retries += 1
+                    self._requeue(batch)
+                    time.sleep(delay)
+                    delay = min(delay * 2, AUDIT_RETRY_DELAY_MAX)
+                else:
+                    self._write_one_by_one(batch, e)
+            finally:
+                with self._cond:
+                    self._writing -= 1
+                    self._cond.notify_all()
+
+    def _insert(self, rows):
+        connection = self._get_connection()
+        try:
+            with connection.cursor() as cursor:
+                # executemany agrupa las filas en INSERT de varias filas
+                cursor.executemany(f'''
+                    INSERT INTO REGISTROHISTORIAL ({', '.join(COLUMNS)})
+                    VALUES ({', '.join(['%s'] * len(COLUMNS))})
+                ''', rows)
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
+        finally:
+            connection.close()
+
+    def _write(self, batch):
+        self._insert(batch)
+        self.written += len(batch)
+        self.batches += 1
+
+    # Un registro inválido hace fallar todo el lote: se insertan por separado
+    # para guardar los válidos y descartar solo los que fallan
+    def _write_one_by_one(self, batch, error):
+        print(f"Error al guardar un lote de {len(batch)} registros, se reintenta uno por uno: {error}")
+        for registro in batch:
+            try:
+                self._insert([registro])
+                self.written += 1
+            except Exception as e:
+                self.failed += 1
+                print(f"Registro descartado {registro}: {e}")
+        self.batches += 1
+
+    # Esperar a que se escriba todo lo encolado hasta ahora
+    def flush(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            if self._queue:
+                self._oldest = 0  # adelantar el próximo lote
+                self._cond.notify_all()
+            while self._queue or self._writing:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    # Vaciar la cola y detener el hilo (se llama al cerrar la aplicación)
+    def stop(self, timeout=10):
+        with self._cond:
+            if self._thread is None or self._pid != os.getpid():
+                return
+            self._stopping = True
+            self._cond.notify_all()
+        self._thread.join(timeout)
+        if self._queue:
+            print(f"Quedaron {len(self._queue)} registros sin guardar al cerrar")
+
+    def stats(self):
+        with self._cond:
+            return {
+                'queued': len(self._queue),
+                'max_queue': self.max_queue,
+                'batch_size': self.batch_size,
+                'flush_interval': self.flush_interval,
+                'written': self.written,
+                'batches': self.batches,
+                'failed': self.failed,
+                'rejected': self.rejected,
+                'retries': self.retries,
+            }
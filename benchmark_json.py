@@ -0,0 +1,95 @@
+# Comparación de la serialización JSON y la compresión de respuestas.
+# Uso: python benchmark_json.py [filas] [repeticiones]
+#
+# Genera filas con la misma forma que devuelve /products (DictCursor con
+# datetime, date y Decimal) y mide el tiempo de serialización con el proveedor
+# por defecto de Flask y con orjson, y los bytes enviados sin comprimir, con
+# gzip y con brotli.
+import sys
+import time
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+import compression
+from json_provider import OrjsonProvider, orjson
+
+
+def generar_filas(cantidad):
+    inicio = datetime(2024, 1, 1, 9, 30)
+    return [
+        {
+            'id_producto': i,
+            'nombre': f'Producto {i}',
+            'descripcion': f'Descripción del producto número {i}, envase de {i % 12 + 1} unidades',
+            'fecha_registro': inicio + timedelta(minutes=i),
+            'fecha_vencimiento': date(2025, 1, 1) + timedelta(days=i % 365),
+            'stock': i % 500,
+            'descuento': Decimal(i % 30) if i % 4 == 0 else None,
+            'vencimiento_descuento': date(2024, 12, 31) if i % 4 == 0 else None,
+            'codigo_barras': f'780{i:010d}',
+            'precio_venta': Decimal(990 + (i % 200) * 10),
+            'estado_producto': 'Activo',
+            'categoria': f'Categoría {i % 25}',
+        }
+        for i in range(cantidad)
+    ]
+
+
+def medir(app, provider_class, filas, repeticiones):
+    app.json = provider_class(app)
+    with app.app_context():
+        mejor = None
+        for _ in range(repeticiones):
+            inicio = time.perf_counter()
+            data = app.json.response(filas).get_data()
+            transcurrido = time.perf_counter() - inicio
+            mejor = transcurrido if mejor is None else min(mejor, transcurrido)
+    return mejor, data
+
+
+def medir_compresion(data, encoding, repeticiones):
+    mejor = None
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        comprimido = compression._compress(data, encoding)
+        transcurrido = time.perf_counter() - inicio
+        mejor = transcurrido if mejor is None else min(mejor, transcurrido)
+    return mejor, len(comprimido)
+
+
+def main():
+    cantidad = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    repeticiones = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    filas = generar_filas(cantidad)
+    app = Flask(__name__)
+
+    print(f'{cantidad} filas, mejor de {repeticiones} repeticiones\n')
+    print(f"{'serializador':<14}{'tiempo (ms)':>14}{'bytes':>14}")
+    tiempo, data = medir(app, DefaultJSONProvider, filas, repeticiones)
+    print(f"{'flask/json':<14}{tiempo * 1000:>14.1f}{len(data):>14}")
+    if orjson is not None:
+        tiempo_orjson, data_orjson = medir(app, OrjsonProvider, filas, repeticiones)
+        print(f"{'orjson':<14}{tiempo_orjson * 1000:>14.1f}{len(data_orjson):>14}")
+        print(f'\norjson es {tiempo / tiempo_orjson:.1f} veces más rápido')
+        data = data_orjson
+    else:
+        print('orjson no está instalado')
+
+    print(f"\n{'compresión':<14}{'tiempo (ms)':>14}{'bytes':>14}{'proporción':>14}")
+    print(f"{'ninguna':<14}{0:>14.1f}{len(data):>14}{1:>14.2f}")
+    for encoding in compression._encodings():
+        tiempo, tamano = medir_compresion(data, encoding, repeticiones)
+        print(f"{encoding:<14}{tiempo * 1000:>14.1f}{tamano:>14}{tamano / len(data):>14.2f}")
+    if compression.brotli is None:
+        print('brotli no está instalado')
+
+    # Comprobar que ambos serializadores producen el mismo documento
+    if orjson is not None:
+        with app.app_context():
+            iguales = DefaultJSONProvider(app).loads(data) == DefaultJSONProvider(app).loads(medir(app, DefaultJSONProvider, filas, 1)[1])
+        print(f'\nMismo contenido con ambos serializadores: {iguales}')
+
+
+if __name__ == '__main__':
+    main()
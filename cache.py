@@ -0,0 +1,134 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+# Caché LRU acotada con expiración por tiempo (TTL) y contadores de uso.
+# Cada entrada puede asociarse a una etiqueta para invalidar varias claves a la vez,
+# y a una versión para descartarla cuando los datos cambian en otro proceso.
+class LRUCache:
+    def __init__(self, max_size=1000, ttl=60):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._data = OrderedDict()  # clave -> (valor, expira_en, etiqueta, versión)
+        self._tags = {}  # etiqueta -> conjunto de claves
+        # Aumenta con cada invalidación; permite descartar valores leídos antes de una
+        # escritura de la misma clave o etiqueta
+        self.generation = 0
+        self._invalidated = OrderedDict()  # ('clave'|'etiqueta', valor) -> generación de la invalidación
+        self._invalidated_before = 0  # las invalidaciones más antiguas ya no se recuerdan una por una
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        self.stale = 0
+
+    def _remove(self, key):
+        _, _, tag, _ = self._data.pop(key)
+        if tag is not None:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+    # Registrar la invalidación de una clave o etiqueta para set(generation=...). Se
+    # recuerdan tantas como entradas admite la caché; al olvidar una, los valores
+    # leídos antes de ella dejan de guardarse.
+    def _mark_invalidated(self, kind, value):
+        self.generation += 1
+        marker = (kind, value)
+        self._invalidated.pop(marker, None)
+        self._invalidated[marker] = self.generation
+        while len(self._invalidated) > self.max_size:
+            _, generation = self._invalidated.popitem(last=False)
+            self._invalidated_before = generation
+
+    def _invalidated_since(self, generation, key, tag):
+        if generation < self._invalidated_before:
+            return True
+        if self._invalidated.get(('clave', key), 0) > generation:
+            return True
+        return tag is not None and self._invalidated.get(('etiqueta', tag), 0) > generation
+
+    # Con `is_stale`, una entrada para la que is_stale(etiqueta, versión) es verdadero
+    # cuenta como ausente
+    def get(self, key, is_stale=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry[1] < time.monotonic():
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            if is_stale is not None and is_stale(entry[2], entry[3]):
+                self._remove(key)
+                self.stale += 1
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    # Si se indica `generation` y desde entonces se invalidó la clave o la etiqueta,
+    # el valor no se guarda. `version` es la versión de los datos leídos.
+    def set(self, key, value, tag=None, generation=None, version=None):
+        with self._lock:
+            if generation is not None and self._invalidated_since(generation, key, tag):
+                return
+            if key in self._data:
+                self._remove(key)
+            self._data[key] = (value, time.monotonic() + self.ttl, tag, version)
+            if tag is not None:
+                self._tags.setdefault(tag, set()).add(key)
+            while len(self._data) > self.max_size:
+                oldest = next(iter(self._data))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._mark_invalidated('clave', key)
+            if key in self._data:
+                self._remove(key)
+                self.invalidations += 1
+
+    # Eliminar todas las claves asociadas a una etiqueta
+    def delete_tag(self, tag):
+        with self._lock:
+            self._mark_invalidated('etiqueta', tag)
+            for key in list(self._tags.get(tag, ())):
+                self._remove(key)
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            # Ningún valor leído antes de vaciar la caché se guarda
+            self._invalidated.clear()
+            self._invalidated_before = self.generation
+            self.invalidations += len(self._data)
+            self._data.clear()
+            self._tags.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._data),
+                'max_size': self.max_size,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations,
+                'stale': self.stale,
+            }
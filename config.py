@@ -1,13 +1,55 @@
-import pymysql, os
+import pymysql, os, threading, time
 from dotenv import load_dotenv
+from db_pool import ConnectionPool, PoolTimeoutError
+from metrics import InstrumentedDictCursor, record_acquire
 
 load_dotenv()
 
-def get_db_connection():
+# Abre una conexión nueva a la base de datos (sin pasar por el pool).
+# El cursor por defecto registra cada consulta en las métricas (ver metrics.py).
+def connect(cursorclass=InstrumentedDictCursor):
     return pymysql.connect(
         host=os.getenv('HOST'),
         user=os.getenv('DB_USER'),
         password=os.getenv('DB_PASSWORD'),
         db=os.getenv('DB_SELLIFY'),
-        cursorclass=pymysql.cursors.DictCursor
-    )
\ No newline at end of file
+        cursorclass=cursorclass
+    )
+
+# Configuración del pool de conexiones
+DB_POOL_MIN = int(os.getenv('DB_POOL_MIN', 1))
+DB_POOL_MAX = int(os.getenv('DB_POOL_MAX', 10))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 10))
+DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', 3600))
+DB_POOL_IDLE_TIMEOUT = int(os.getenv('DB_POOL_IDLE_TIMEOUT', 300))
+DB_POOL_PING_INTERVAL = int(os.getenv('DB_POOL_PING_INTERVAL', 30))
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(
+                    connect,
+                    min_size=DB_POOL_MIN,
+                    max_size=DB_POOL_MAX,
+                    timeout=DB_POOL_TIMEOUT,
+                    recycle=DB_POOL_RECYCLE,
+                    idle_timeout=DB_POOL_IDLE_TIMEOUT,
+                    ping_interval=DB_POOL_PING_INTERVAL
+                )
+    return _pool
+
+# Obtiene una conexión del pool. Llamar a close() (o usarla con `with`)
+# la devuelve al pool en lugar de cerrarla.
+def get_db_connection(timeout=None):
+    start = time.perf_counter()
+    connection = get_pool().acquire(timeout)
+    record_acquire(time.perf_counter() - start)
+    return connection
+
+def get_pool_stats():
+    return get_pool().stats()
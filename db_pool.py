@@ -0,0 +1,245 @@
+import os
+import threading
+import time
+from collections import deque
+
+from pymysql.constants import SERVER_STATUS
+
+
+class PoolTimeoutError(Exception):
+    # Se lanza cuando no hay conexiones disponibles dentro del tiempo de espera
+    pass
+
+
+# Conexión prestada por el pool. Se comporta como una conexión de pymysql,
+# pero close() la devuelve al pool en lugar de cerrarla.
+class PooledConnection:
+    def __init__(self, pool, raw):
+        self._pool = pool
+        self._raw = raw
+        self._released = False
+
+    def __getattr__(self, name):
+        if self._released:
+            raise RuntimeError('La conexión ya fue devuelta al pool')
+        return getattr(self._raw, name)
+
+    def close(self):
+        if not self._released:
+            self._released = True
+            self._pool._release(self._raw)
+
+    # Descartar la conexión (por ejemplo si quedó en un estado inválido)
+    def discard(self):
+        if not self._released:
+            self._released = True
+            self._pool._release(self._raw, discard=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+
+# Pool de conexiones acotado y seguro para hilos
+class ConnectionPool:
+    def __init__(self, connect, min_size=1, max_size=10, timeout=10.0,
+                 recycle=3600, idle_timeout=300, ping_interval=30):
+        if min_size < 0 or max_size < 1 or min_size > max_size:
+            raise ValueError('Tamaño de pool inválido')
+
+        self._connect = connect
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.recycle = recycle
+        self.idle_timeout = idle_timeout
+        self.ping_interval = ping_interval
+
+        self._lock = threading.Condition()
+        self._idle = deque()  # (conexión, creada_en, devuelta_en)
+        self._created_at = {}
+        self._size = 0
+        self._pid = os.getpid()
+
+        self._checkouts = 0
+        self._timeouts = 0
+        self._waits = 0
+        self._wait_time = 0.0
+        self._max_wait_time = 0.0
+        self._created = 0
+        self._discarded = 0
+
+    def _new_connection(self):
+        raw = self._connect()
+        self._created_at[id(raw)] = time.monotonic()
+        self._created += 1
+        return raw
+
+    def _close_raw(self, raw):
+        self._created_at.pop(id(raw), None)
+        self._discarded += 1
+        try:
+            raw.close()
+        except Exception:
+            pass
+
+    # Si el proceso hizo fork, las conexiones heredadas no se pueden compartir
+    def _check_fork(self):
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._idle.clear()
+            self._created_at.clear()
+            self._size = 0
+
+    # Rellenar el pool hasta el tamaño mínimo
+    def fill(self):
+        with self._lock:
+            self._check_fork()
+            missing = max(self.min_size - self._size, 0)
+            self._size += missing
+        for created in range(missing):
+            try:
+                raw = self._new_connection()
+            except Exception:
+                # Liberar los lugares reservados que no llegaron a tener conexión
+                with self._lock:
+                    self._size -= missing - created
+                    self._lock.notify_all()
+                raise
+            with self._lock:
+                self._idle.append((raw, time.monotonic()))
+                self._lock.notify()
+
+    def _is_expired(self, raw, now):
+        created = self._created_at.get(id(raw), now)
+        return self.recycle and now - created > self.recycle
+
+    def acquire(self, timeout=None):
+        timeout = self.timeout if timeout is None else timeout
+        start = time.monotonic()
+        deadline = start + timeout
+        waited = False
+
+        while True:
+            raw = None
+            create = False
+            with self._lock:
+                self._check_fork()
+                while not self._idle and self._size >= self.max_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._timeouts += 1
+                        raise PoolTimeoutError(
+                            f'No hay conexiones disponibles tras {timeout} segundos'
+                        )
+                    waited = True
+                    self._lock.wait(remaining)
+
+                if self._idle:
+                    raw, returned_at = self._idle.pop()
+                else:
+                    self._size += 1
+                    create = True
+
+            if create:
+                try:
+                    raw = self._new_connection()
+                except Exception:
+                    with self._lock:
+                        self._size -= 1
+                        self._lock.notify()
+                    raise
+            elif not self._validate(raw, returned_at):
+                with self._lock:
+                    self._size -= 1
+                    self._close_raw(raw)
+                    self._lock.notify()
+                continue
+
+            elapsed = time.monotonic() - start
+            with self._lock:
+                self._checkouts += 1
+                if waited:
+                    self._waits += 1
+                self._wait_time += elapsed
+                self._max_wait_time = max(self._max_wait_time, elapsed)
+            return PooledConnection(self, raw)
+
+    # Comprobar que una conexión ociosa sigue siendo utilizable
+    def _validate(self, raw, returned_at):
+        now = time.monotonic()
+        if self._is_expired(raw, now):
+            return False
+        if self.idle_timeout and now - returned_at > self.idle_timeout:
+            return False
+        if now - returned_at > self.ping_interval:
+            try:
+                raw.ping(reconnect=False)
+            except Exception:
+                return False
+        return True
+
+    def _release(self, raw, discard=False):
+        if not discard:
+            # Deshacer la transacción que la ruta haya dejado abierta; si el servidor
+            # informa que no hay ninguna, se evita el viaje de ida y vuelta del ROLLBACK
+            estado = getattr(raw, 'server_status', SERVER_STATUS.SERVER_STATUS_IN_TRANS)
+            if estado & SERVER_STATUS.SERVER_STATUS_IN_TRANS:
+                try:
+                    raw.rollback()
+                except Exception:
+                    discard = True
+
+        with self._lock:
+            if self._pid != os.getpid():
+                return
+            if discard or self._is_expired(raw, time.monotonic()):
+                self._size -= 1
+                self._close_raw(raw)
+            else:
+                self._idle.append((raw, time.monotonic()))
+            self._evict_idle()
+            self._lock.notify()
+
+    # Cerrar conexiones que llevan demasiado tiempo ociosas (respetando el mínimo)
+    def _evict_idle(self):
+        if not self.idle_timeout:
+            return
+        now = time.monotonic()
+        while self._idle and self._size > self.min_size:
+            raw, returned_at = self._idle[0]
+            if now - returned_at <= self.idle_timeout:
+                break
+            self._idle.popleft()
+            self._size -= 1
+            self._close_raw(raw)
+
+    def close_all(self):
+        with self._lock:
+            while self._idle:
+                raw, _ = self._idle.popleft()
+                self._size -= 1
+                self._close_raw(raw)
+            self._lock.notify_all()
+
+    def stats(self):
+        with self._lock:
+            idle = len(self._idle)
+            return {
+                'min_size': self.min_size,
+                'max_size': self.max_size,
+                'size': self._size,
+                'in_use': self._size - idle,
+                'idle': idle,
+                'checkouts': self._checkouts,
+                'waits': self._waits,
+                'timeouts': self._timeouts,
+                'wait_time_total': round(self._wait_time, 6),
+                'wait_time_max': round(self._max_wait_time, 6),
+                'wait_time_avg': round(self._wait_time / self._checkouts, 6) if self._checkouts else 0.0,
+                'connections_created': self._created,
+                'connections_closed': self._discarded,
+            }
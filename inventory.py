@@ -0,0 +1,87 @@
+from decimal import Decimal
+
+
+class StockError(Exception):
+    # Se lanza cuando una venta pide más unidades de las disponibles
+    def __init__(self, faltantes):
+        super().__init__('Stock insuficiente')
+        self.faltantes = faltantes
+
+
+# Sumar las cantidades por producto (un producto puede repetirse en la lista)
+def sumar_cantidades(detalles):
+    cantidades = {}
+    for id_producto, cantidad in detalles:
+        if not isinstance(cantidad, int):
+            cantidad = Decimal(str(cantidad))
+        cantidades[id_producto] = cantidades.get(id_producto, 0) + cantidad
+    return cantidades
+
+
+# Bloquear las filas de STOCK de los productos (en orden de id para evitar
+# interbloqueos entre cajas) y devolver el stock actual de cada uno
+def _bloquear_stock(cursor, ids):
+    placeholders = ', '.join(['%s'] * len(ids))
+    cursor.execute(f'''
+        SELECT id_producto, COALESCE(stock, 0) AS stock
+        FROM STOCK
+        WHERE id_producto IN ({placeholders})
+        ORDER BY id_producto
+        FOR UPDATE
+    ''', ids)
+    return {row['id_producto']: row['stock'] for row in cursor.fetchall()}
+
+
+# Sumar (signo 1) o restar (signo -1) las cantidades al stock con una sola sentencia.
+# Un stock NULL (por ejemplo, si se editó el producto sin indicarlo) cuenta como 0.
+def _actualizar_stock(cursor, cantidades, signo):
+    ids = sorted(cantidades)
+    case = ' '.join(['WHEN %s THEN %s'] * len(ids))
+    params = []
+    for id_producto in ids:
+        params.extend([id_producto, cantidades[id_producto]])
+    placeholders = ', '.join(['%s'] * len(ids))
+    operador = '+' if signo > 0 else '-'
+    cursor.execute(f'''
+        UPDATE STOCK
+        SET stock = COALESCE(stock, 0) {operador} CASE id_producto {case} END
+        WHERE id_producto IN ({placeholders})
+    ''', params + ids)
+
+
+# Descontar del stock las cantidades vendidas dentro de la transacción de la venta.
+# Si `rechazar_sobreventa` es verdadero y algún producto no alcanza, lanza StockError.
+# Sin rechazo no hace falta leer el stock: el UPDATE ya bloquea las filas.
+def descontar_stock(cursor, cantidades, rechazar_sobreventa=False):
+    if not cantidades:
+        return
+
+    if rechazar_sobreventa:
+        ids = sorted(cantidades)
+        stock_actual = _bloquear_stock(cursor, ids)
+        faltantes = [
+            {"id_producto": id_producto, "stock": stock_actual.get(id_producto) or 0, "solicitado": cantidades[id_producto]}
+            for id_producto in ids
+            if (stock_actual.get(id_producto) or 0) < cantidades[id_producto]
+        ]
+        if faltantes:
+            raise StockError(faltantes)
+
+    _actualizar_stock(cursor, cantidades, -1)
+
+
+# Sumar al stock las cantidades compradas dentro de la transacción de la compra.
+# Los productos sin fila en STOCK la reciben con la cantidad comprada.
+def reponer_stock(cursor, cantidades):
+    if not cantidades:
+        return
+    ids = sorted(cantidades)
+    stock_actual = _bloquear_stock(cursor, ids)
+
+    existentes = {id_producto: cantidades[id_producto] for id_producto in ids if id_producto in stock_actual}
+    if existentes:
+        _actualizar_stock(cursor, existentes, 1)
+
+    nuevos = [(id_producto, cantidades[id_producto]) for id_producto in ids if id_producto not in stock_actual]
+    if nuevos:
+        cursor.executemany('INSERT INTO STOCK (id_producto, stock) VALUES (%s, %s)', nuevos)
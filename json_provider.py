@@ -0,0 +1,81 @@
+import dataclasses
+import decimal
+import uuid
+from datetime import date, datetime, time
+from flask.json.provider import DefaultJSONProvider
+from werkzeug.http import http_date
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+_DIAS = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')
+_MESES = ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec')
+
+
+# Igual que werkzeug.http.http_date para fechas sin zona horaria (las que entrega
+# PyMySQL), pero sin pasar por email.utils, que domina el costo de serializar
+def _http_date(o):
+    if isinstance(o, datetime):
+        if o.tzinfo is not None:
+            return http_date(o)
+        hora = o
+    else:
+        hora = time()
+    return (f'{_DIAS[o.weekday()]}, {o.day:02d} {_MESES[o.month - 1]} {o.year:04d} '
+            f'{hora.hour:02d}:{hora.minute:02d}:{hora.second:02d} GMT')
+
+
+# Mismas conversiones que el proveedor por defecto de Flask, para que las
+# respuestas no cambien de formato: fechas en formato HTTP, Decimal y UUID como texto
+def _default(o):
+    if isinstance(o, date):
+        return _http_date(o)
+    if isinstance(o, (decimal.Decimal, uuid.UUID)):
+        return str(o)
+    if dataclasses.is_dataclass(o):
+        return dataclasses.asdict(o)
+    if hasattr(o, '__html__'):
+        return str(o.__html__())
+    raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
+
+
+# Serializador JSON basado en orjson. Las fechas se delegan a `_default`
+# (OPT_PASSTHROUGH_DATETIME) porque orjson las escribiría en formato ISO.
+class OrjsonProvider(DefaultJSONProvider):
+    def _options(self):
+        options = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+        if self.sort_keys:
+            options |= orjson.OPT_SORT_KEYS
+        return options
+
+    def dumps(self, obj, **kwargs):
+        # Opciones propias de json.dumps (indent, separators...) usan el serializador estándar
+        if kwargs:
+            return super().dumps(obj, **kwargs)
+        return orjson.dumps(obj, default=_default, option=self._options()).decode()
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        if (self.compact is None and self._app.debug) or self.compact is False:
+            return super().response(*args, **kwargs)
+
+        # Se construye la respuesta directamente con los bytes, sin pasar por str
+        obj = self._prepare_response_obj(args, kwargs)
+        data = orjson.dumps(obj, default=_default, option=self._options() | orjson.OPT_APPEND_NEWLINE)
+        return self._app.response_class(data, mimetype=self.mimetype)
+
+
+# Proveedor según JSON_SERIALIZER: 'orjson' (por defecto si está instalado) o 'default'
+def get_json_provider_class(name=None):
+    if name in (None, '', 'orjson') and orjson is not None:
+        return OrjsonProvider
+    if name == 'orjson':
+        print("orjson no está instalado, se usa el serializador JSON por defecto")
+    return DefaultJSONProvider
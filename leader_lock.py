@@ -0,0 +1,23 @@
+from contextlib import contextmanager
+
+
+# Bloqueo con nombre de MySQL (GET_LOCK) para que una tarea programada se ejecute
+# en un solo proceso aunque haya varios workers o servidores. El bloqueo pertenece
+# a la sesión de `connection`, que debe mantenerse abierta mientras dure la tarea.
+# Entrega True si se obtuvo el bloqueo y False si otro proceso lo tiene.
+@contextmanager
+def leader_lock(connection, name, timeout=0):
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT GET_LOCK(%s, %s) AS adquirido', (name, timeout))
+        acquired = cursor.fetchone()['adquirido'] == 1
+
+    try:
+        yield acquired
+    finally:
+        if acquired:
+            try:
+                with connection.cursor() as cursor:
+                    cursor.execute('SELECT RELEASE_LOCK(%s)', (name,))
+            except Exception as e:
+                # Si la conexión se perdió, MySQL ya liberó el bloqueo
+                print(f"No se pudo liberar el bloqueo {name}: {e}")
@@ -0,0 +1,254 @@
+import contextvars
+import os
+import threading
+import time
+import pymysql.cursors
+from flask import Response, g, jsonify, request
+import slow_queries
+
+# Se puede desactivar el encabezado Server-Timing con METRICS_SERVER_TIMING=0
+METRICS_SERVER_TIMING = os.getenv('METRICS_SERVER_TIMING', '1') != '0'
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+ACQUIRE_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5)
+
+# Endpoint con que se registran las consultas hechas fuera de una solicitud (tareas programadas)
+BACKGROUND_ENDPOINT = 'background'
+
+
+# Contadores de la solicitud en curso
+class RequestMetrics:
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.rows = 0
+        self.acquires = 0
+        self.acquire_time = 0.0
+
+
+_current = contextvars.ContextVar('request_metrics', default=None)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for i, limit in enumerate(self.buckets):
+            if value <= limit:
+                self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+
+
+# Métricas acumuladas del proceso, agrupadas por endpoint
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latency = {}  # (método, endpoint) -> Histogram
+        self.queries_per_request = {}  # endpoint -> Histogram
+        self.requests = {}  # (método, endpoint, estado) -> cantidad
+        self.db_queries = {}  # endpoint -> cantidad
+        self.db_time = {}  # endpoint -> segundos
+        self.db_rows = {}  # endpoint -> filas
+        self.acquire = Histogram(ACQUIRE_BUCKETS)
+
+    def record_request(self, method, endpoint, status, elapsed, request_metrics):
+        with self._lock:
+            self.latency.setdefault((method, endpoint), Histogram(LATENCY_BUCKETS)).observe(elapsed)
+            self.queries_per_request.setdefault(endpoint, Histogram(QUERY_COUNT_BUCKETS)).observe(request_metrics.queries)
+            key = (method, endpoint, status)
+            self.requests[key] = self.requests.get(key, 0) + 1
+
+    def record_query(self, endpoint, elapsed, rows):
+        with self._lock:
+            self.db_queries[endpoint] = self.db_queries.get(endpoint, 0) + 1
+            self.db_time[endpoint] = self.db_time.get(endpoint, 0.0) + elapsed
+            self.db_rows[endpoint] = self.db_rows.get(endpoint, 0) + rows
+
+    def record_rows(self, endpoint, rows):
+        with self._lock:
+            self.db_rows[endpoint] = self.db_rows.get(endpoint, 0) + rows
+
+    def record_acquire(self, elapsed):
+        with self._lock:
+            self.acquire.observe(elapsed)
+
+    # Texto en el formato de exposición de Prometheus
+    def render(self, gauges=None):
+        lines = []
+        with self._lock:
+            _histogram(lines, 'http_request_duration_seconds', 'Duración de las solicitudes HTTP',
+                       {_labels(method=m, endpoint=e): h for (m, e), h in self.latency.items()})
+            _counter(lines, 'http_requests_total', 'Solicitudes HTTP atendidas',
+                     {_labels(method=m, endpoint=e, status=s): v for (m, e, s), v in self.requests.items()})
+            _histogram(lines, 'db_queries_per_request', 'Consultas a la base de datos por solicitud',
+                       {_labels(endpoint=e): h for e, h in self.queries_per_request.items()})
+            _counter(lines, 'db_queries_total', 'Consultas ejecutadas',
+                     {_labels(endpoint=e): v for e, v in self.db_queries.items()})
+            _counter(lines, 'db_query_duration_seconds_total', 'Tiempo total en consultas',
+                     {_labels(endpoint=e): round(v, 6) for e, v in self.db_time.items()})
+            _counter(lines, 'db_rows_total', 'Filas devueltas o afectadas por las consultas',
+                     {_labels(endpoint=e): v for e, v in self.db_rows.items()})
+            _histogram(lines, 'db_pool_acquire_seconds', 'Espera para obtener una conexión del pool',
+                       {'': self.acquire})
+        for name, (description, value) in (gauges or {}).items():
+            lines.append(f'# HELP {name} {description}')
+            lines.append(f'# TYPE {name} gauge')
+            lines.append(f'{name} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(**labels):
+    return ','.join(f'{key}="{_escape(value)}"' for key, value in labels.items())
+
+
+def _bucket_labels(labels, limit):
+    le = f'le="{limit}"'
+    return '{' + (f'{labels},{le}' if labels else le) + '}'
+
+
+def _counter(lines, name, description, values):
+    lines.append(f'# HELP {name} {description}')
+    lines.append(f'# TYPE {name} counter')
+    for labels, value in sorted(values.items()):
+        lines.append(f'{name}{{{labels}}} {value}' if labels else f'{name} {value}')
+
+
+def _histogram(lines, name, description, histograms):
+    lines.append(f'# HELP {name} {description}')
+    lines.append(f'# TYPE {name} histogram')
+    for labels, histogram in sorted(histograms.items()):
+        for limit, count in zip(histogram.buckets, histogram.counts):
+            lines.append(f'{name}_bucket{_bucket_labels(labels, limit)} {count}')
+        lines.append(f'{name}_bucket{_bucket_labels(labels, "+Inf")} {histogram.count}')
+        suffix = '{' + labels + '}' if labels else ''
+        lines.append(f'{name}_sum{suffix} {round(histogram.sum, 6)}')
+        lines.append(f'{name}_count{suffix} {histogram.count}')
+
+
+registry = MetricsRegistry()
+
+
+def _endpoint():
+    try:
+        if request.url_rule is not None:
+            return request.url_rule.rule
+        return 'not_found'
+    except RuntimeError:
+        return BACKGROUND_ENDPOINT
+
+
+# Registrar una consulta en la solicitud en curso y en el acumulado del endpoint
+def record_query(elapsed, rows):
+    rows = rows or 0
+    current = _current.get()
+    if current is not None:
+        current.queries += 1
+        current.db_time += elapsed
+        current.rows += rows
+    registry.record_query(_endpoint(), elapsed, rows)
+
+
+def record_rows(rows):
+    current = _current.get()
+    if current is not None:
+        current.rows += rows
+    registry.record_rows(_endpoint(), rows)
+
+
+def record_acquire(elapsed):
+    current = _current.get()
+    if current is not None:
+        current.acquires += 1
+        current.acquire_time += elapsed
+    registry.record_acquire(elapsed)
+
+
+# Cursores que miden cada consulta. config.connect los usa por defecto.
+class _InstrumentedMixin:
+    def execute(self, query, args=None):
+        start = time.perf_counter()
+        try:
+            return super().execute(query, args)
+        finally:
+            elapsed = time.perf_counter() - start
+            rows = self._rows_for_metrics()
+            record_query(elapsed, rows)
+            if slow_queries.is_slow(elapsed):
+                slow_queries.record(self, query, args, elapsed, rows, _endpoint())
+
+    # Filas devueltas (SELECT) o afectadas (INSERT, UPDATE, DELETE)
+    def _rows_for_metrics(self):
+        if self._rows is not None:
+            return len(self._rows)
+        return max(self.rowcount, 0)
+
+
+class InstrumentedDictCursor(_InstrumentedMixin, pymysql.cursors.DictCursor):
+    pass
+
+
+class InstrumentedSSDictCursor(_InstrumentedMixin, pymysql.cursors.SSDictCursor):
+    # Las filas de un cursor de streaming se cuentan a medida que se leen
+    def _rows_for_metrics(self):
+        return None
+
+    def read_next(self):
+        row = super().read_next()
+        if row is not None:
+            record_rows(1)
+        return row
+
+
+def _before_request():
+    g._metrics_token = _current.set(RequestMetrics())
+
+
+def _after_request(response):
+    current = _current.get()
+    if current is None:
+        return response
+
+    elapsed = time.perf_counter() - current.start
+    registry.record_request(request.method, _endpoint(), response.status_code, elapsed, current)
+
+    if METRICS_SERVER_TIMING:
+        response.headers.add('Server-Timing', ', '.join([
+            f'db;dur={current.db_time * 1000:.2f};desc="{current.queries} consultas, {current.rows} filas"',
+            f'pool;dur={current.acquire_time * 1000:.2f};desc="{current.acquires} conexiones"',
+            f'app;dur={elapsed * 1000:.2f}',
+        ]))
+    return response
+
+
+def _teardown_request(exc):
+    token = g.pop('_metrics_token', None)
+    if token is not None:
+        _current.reset(token)
+
+
+# Registrar los ganchos de la solicitud y la ruta /metrics.
+# `gauges` devuelve valores instantáneos adicionales: {nombre: (descripción, valor)}.
+def init_metrics(app, gauges=None):
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.teardown_request(_teardown_request)
+
+    @app.route('/metrics', methods=['GET'])
+    def get_metrics():
+        return Response(registry.render(gauges() if gauges else None), mimetype='text/plain; version=0.0.4')
+
+    # Últimas consultas que superaron SLOW_QUERY_MS, con su plan de ejecución
+    @app.route('/metrics/slow-queries', methods=['GET'])
+    def get_slow_queries():
+        return jsonify(slow_queries.recent()), 200
@@ -0,0 +1,27 @@
+-- Resúmenes diarios de ventas usados por los endpoints del panel
+-- (best-sale-of-week, best-seller-of-month, top-users-by-sales).
+-- Se actualizan al registrar cada venta y se reconstruyen con:
+--   flask --app app reconstruir-resumen-ventas
+
+CREATE TABLE IF NOT EXISTS RESUMENVENTACAJERO (
+    fecha DATE NOT NULL,
+    id_cajero INT NOT NULL,
+    numero_ventas INT NOT NULL DEFAULT 0,
+    total_ventas DECIMAL(14, 2) NOT NULL DEFAULT 0,
+    venta_maxima DECIMAL(14, 2) NOT NULL DEFAULT 0,
+    id_venta_maxima INT NULL,
+    PRIMARY KEY (fecha, id_cajero),
+    KEY idx_resumen_cajero_cajero (id_cajero, fecha)
+);
+
+CREATE TABLE IF NOT EXISTS RESUMENVENTACLIENTE (
+    fecha DATE NOT NULL,
+    id_cliente INT NOT NULL,
+    numero_ventas INT NOT NULL DEFAULT 0,
+    total_ventas DECIMAL(14, 2) NOT NULL DEFAULT 0,
+    PRIMARY KEY (fecha, id_cliente),
+    KEY idx_resumen_cliente_cliente (id_cliente, fecha)
+);
+
+-- top-users-by-points ordena PUNTOS por puntos
+CREATE INDEX idx_puntos_puntos ON PUNTOS (puntos);
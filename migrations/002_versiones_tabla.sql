@@ -0,0 +1,13 @@
+-- Contador de versión por catálogo, usado para calcular los ETag de
+-- /products, /product/barcode/<codigo>, /categories y /tiposusuario.
+-- Cada escritura sobre el catálogo incrementa la versión en su misma transacción.
+
+CREATE TABLE IF NOT EXISTS VERSIONTABLA (
+    tabla VARCHAR(64) NOT NULL PRIMARY KEY,
+    version BIGINT UNSIGNED NOT NULL DEFAULT 0
+);
+
+INSERT IGNORE INTO VERSIONTABLA (tabla, version) VALUES
+    ('productos', 0),
+    ('categorias', 0),
+    ('tipousuario', 0);
@@ -0,0 +1,20 @@
+-- Registro de cambios del catálogo para la sincronización incremental
+-- (GET /products/changes). Una fila por producto con la versión de
+-- VERSIONTABLA en que cambió por última vez; eliminado = 1 para los inactivos.
+
+CREATE TABLE IF NOT EXISTS CAMBIOSPRODUCTO (
+    id_producto INT NOT NULL PRIMARY KEY,
+    version BIGINT UNSIGNED NOT NULL,
+    eliminado TINYINT(1) NOT NULL DEFAULT 0,
+    fecha_cambio TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    KEY idx_cambios_version (version, id_producto)
+);
+
+-- Los productos existentes se registran con la versión 1, de modo que
+-- since=0 devuelve el catálogo completo
+UPDATE VERSIONTABLA SET version = GREATEST(version, 1) WHERE tabla = 'productos';
+
+INSERT IGNORE INTO CAMBIOSPRODUCTO (id_producto, version, eliminado)
+SELECT p.id_producto, 1, COALESCE(e.estado = 'inactivo', 0)
+FROM PRODUCTOS p
+LEFT JOIN ESTADO e ON p.id_estado = e.id_estado;
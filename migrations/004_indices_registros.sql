@@ -0,0 +1,12 @@
+-- Índices para los filtros de GET /registros.
+--   usuario + rango de fechas  -> idx_registro_usuario_fecha
+--   tipo + rango de fechas     -> idx_registro_tipo_fecha
+--   solo rango de fechas       -> idx_registro_fecha
+--   q (texto)                  -> ft_registro_texto
+-- InnoDB agrega id_registro al final de cada índice secundario, por lo que el
+-- orden (fecha_y_hora, id_registro) de la paginación se lee directamente del índice.
+
+CREATE INDEX idx_registro_fecha ON REGISTROHISTORIAL (fecha_y_hora);
+CREATE INDEX idx_registro_usuario_fecha ON REGISTROHISTORIAL (usuario, fecha_y_hora);
+CREATE INDEX idx_registro_tipo_fecha ON REGISTROHISTORIAL (tipo, fecha_y_hora);
+CREATE FULLTEXT INDEX ft_registro_texto ON REGISTROHISTORIAL (mensaje, descripcion);
@@ -0,0 +1,2 @@
+-- La retención (retention.py) y los filtros de GET /ventas recorren VENTA por fecha
+CREATE INDEX idx_venta_fecha ON VENTA (fecha_venta, id_venta);
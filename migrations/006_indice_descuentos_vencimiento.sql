@@ -0,0 +1,2 @@
+-- La eliminación de descuentos vencidos busca por fecha de vencimiento en lotes
+CREATE INDEX idx_descuentos_vencimiento ON DESCUENTOS (vencimiento_descuento, id_producto);
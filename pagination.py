@@ -0,0 +1,163 @@
+import base64
+import json
+import os
+from flask import g, request
+
+PAGE_SIZE_DEFAULT = int(os.getenv('PAGE_SIZE_DEFAULT', 100))
+PAGE_SIZE_MAX = int(os.getenv('PAGE_SIZE_MAX', 1000))
+# limit=all devuelve el listado completo sin paginar, como antes de la paginación.
+# Está obsoleto: las respuestas llevan el encabezado Deprecation y se puede
+# desactivar con PAGE_ALLOW_UNLIMITED=0, con lo que limit=all responde 400.
+PAGE_ALLOW_UNLIMITED = os.getenv('PAGE_ALLOW_UNLIMITED', '1') != '0'
+UNLIMITED = 'all'
+
+
+class PaginationError(ValueError):
+    pass
+
+
+# El cursor es opaco para el cliente: contiene los valores de la clave de la última fila
+def encode_cursor(values):
+    raw = json.dumps(list(values), separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        values = json.loads(raw)
+    except (ValueError, TypeError):
+        raise PaginationError('Cursor inválido')
+    if not isinstance(values, list) or not values:
+        raise PaginationError('Cursor inválido')
+    # Solo valores escalares: una lista u objeto no se puede enlazar como parámetro SQL
+    if any(isinstance(v, bool) or not isinstance(v, (str, int, float)) for v in values):
+        raise PaginationError('Cursor inválido')
+    return values
+
+
+# Página solicitada con paginación por clave (keyset): se devuelven las filas
+# cuya clave es mayor que la del cursor `after`, en orden ascendente.
+class Page:
+    def __init__(self, limit, after=None):
+        self.limit = limit
+        self.after = after
+
+    # Condición SQL para continuar después del cursor
+    def keyset_condition(self, columns):
+        if self.after is None:
+            return None, []
+        if len(self.after) != len(columns):
+            raise PaginationError('Cursor inválido')
+
+        # (a > x) OR (a = x AND b > y) ... se expande para que MySQL use el índice
+        clauses = []
+        params = []
+        for i, column in enumerate(columns):
+            parts = [f'{previous} = %s' for previous in columns[:i]] + [f'{column} > %s']
+            clauses.append('(' + ' AND '.join(parts) + ')')
+            params.extend(self.after[:i] + [self.after[i]])
+        return '(' + ' OR '.join(clauses) + ')', params
+
+    def order_clause(self, columns):
+        # Se pide una fila extra para saber si existe una página siguiente
+        return f" ORDER BY {', '.join(columns)} LIMIT %s", [self.limit + 1]
+
+    def result(self, rows, key):
+        has_more = len(rows) > self.limit
+        items = rows[:self.limit]
+        return {
+            "items": items,
+            "limit": self.limit,
+            "next_cursor": encode_cursor(key(items[-1])) if has_more else None,
+        }
+
+    # Resultado cuando la página cuenta grupos de filas con la misma clave (por
+    # ejemplo, un producto con varios códigos de barras). Las filas deben venir
+    # ordenadas por la clave y la consulta debe traer `limit` + 1 grupos.
+    def grouped_result(self, rows, key):
+        items = []
+        last_key = None
+        groups = 0
+        has_more = False
+        for row in rows:
+            row_key = key(row)
+            if row_key != last_key:
+                groups += 1
+                if groups > self.limit:
+                    has_more = True
+                    break
+                last_key = row_key
+            items.append(row)
+        return {
+            "items": items,
+            "limit": self.limit,
+            "next_cursor": encode_cursor(last_key) if has_more else None,
+        }
+
+
+# Leer los parámetros `limit` y `after` de la solicitud. Sin ellos se devuelve
+# la primera página de PAGE_SIZE_DEFAULT elementos; con limit=all, None (sin paginar).
+def get_page():
+    limit = request.args.get('limit')
+    after = request.args.get('after')
+
+    if limit == UNLIMITED:
+        if not PAGE_ALLOW_UNLIMITED:
+            raise PaginationError('limit=all ya no está disponible; use limit y after para recorrer las páginas')
+        if after:
+            raise PaginationError('limit=all no se puede combinar con after')
+        g.unlimited_page = True
+        return None
+
+    if limit is None:
+        limit = PAGE_SIZE_DEFAULT
+    else:
+        try:
+            limit = int(limit)
+        except ValueError:
+            raise PaginationError('El parámetro limit debe ser un número entero')
+        if limit < 1:
+            raise PaginationError('El parámetro limit debe ser mayor que cero')
+        limit = min(limit, PAGE_SIZE_MAX)
+
+    return Page(limit, decode_cursor(after) if after else None)
+
+
+# Agregar condiciones WHERE a una consulta
+def add_where(query, conditions):
+    if conditions:
+        query += ' WHERE ' + ' AND '.join(conditions)
+    return query
+
+
+# Completar una consulta con sus condiciones, su GROUP BY opcional y, si hay
+# página, con el cursor, el orden por la clave `columns` y el límite
+def paginate_query(query, conditions, params, page, columns, group_by=None):
+    conditions = list(conditions)
+    params = list(params)
+    if page:
+        condition, condition_params = page.keyset_condition(columns)
+        if condition:
+            conditions.append(condition)
+            params.extend(condition_params)
+
+    query = add_where(query, conditions)
+    if group_by:
+        query += ' GROUP BY ' + ', '.join(group_by)
+    if page:
+        order, order_params = page.order_clause(columns)
+        query += order
+        params.extend(order_params)
+    return query, params
+
+
+# Marcar como obsoletas las respuestas pedidas con limit=all
+def _after_request(response):
+    if g.pop('unlimited_page', False):
+        response.headers['Deprecation'] = 'true'
+    return response
+
+
+def init_pagination(app):
+    app.after_request(_after_request)
@@ -0,0 +1,98 @@
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from werkzeug.security import generate_password_hash, check_password_hash
+
+# Método y costo del hash (formato de werkzeug), por ejemplo 'scrypt:32768:8:1'
+# o 'pbkdf2:sha256:600000'. Sin valor se usa el método por defecto de werkzeug.
+PASSWORD_HASH_METHOD = os.getenv('PASSWORD_HASH_METHOD')
+# Procesos dedicados al hash; con 0 se calcula en el hilo de la solicitud.
+# Es un número fijo y pequeño porque cada instancia de la API tiene su propio pool
+# y en producción se levanta una instancia por núcleo (ver README).
+HASH_WORKERS = int(os.getenv('HASH_WORKERS', 2))
+# Máximo de operaciones en curso o en espera antes de rechazar con 503
+HASH_MAX_PENDING = int(os.getenv('HASH_MAX_PENDING', max(HASH_WORKERS, 1) * 4))
+HASH_TIMEOUT = float(os.getenv('HASH_TIMEOUT', 10))
+
+
+class HashingBusyError(Exception):
+    pass
+
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+_pending = threading.BoundedSemaphore(HASH_MAX_PENDING)
+
+_stats_lock = threading.Lock()
+_stats = {}
+
+
+def _get_executor():
+    global _executor, _executor_pid
+    with _executor_lock:
+        # Un proceso hijo (fork) no puede reutilizar el pool del padre
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ProcessPoolExecutor(max_workers=HASH_WORKERS)
+            _executor_pid = os.getpid()
+        return _executor
+
+
+def _record(operation, elapsed):
+    with _stats_lock:
+        stats = _stats.setdefault(operation, {'calls': 0, 'total_time': 0.0, 'max_time': 0.0})
+        stats['calls'] += 1
+        stats['total_time'] += elapsed
+        stats['max_time'] = max(stats['max_time'], elapsed)
+
+
+def _run(operation, func, *args):
+    start = time.monotonic()
+    if not _pending.acquire(timeout=HASH_TIMEOUT):
+        raise HashingBusyError('Demasiadas operaciones de contraseña en curso')
+    try:
+        if HASH_WORKERS <= 0:
+            return func(*args)
+        future = _get_executor().submit(func, *args)
+        try:
+            return future.result(timeout=HASH_TIMEOUT)
+        except FutureTimeoutError:
+            future.cancel()
+            raise HashingBusyError('La operación de contraseña excedió el tiempo de espera')
+    finally:
+        _pending.release()
+        _record(operation, time.monotonic() - start)
+
+
+def hash_password(password):
+    if PASSWORD_HASH_METHOD:
+        return _run('hash', generate_password_hash, password, PASSWORD_HASH_METHOD)
+    return _run('hash', generate_password_hash, password)
+
+
+def verify_password(password_hash, password):
+    return _run('verify', check_password_hash, password_hash, password)
+
+
+def stats():
+    with _stats_lock:
+        result = {
+            'workers': HASH_WORKERS,
+            'max_pending': HASH_MAX_PENDING,
+            'method': PASSWORD_HASH_METHOD or 'default',
+        }
+        for operation, values in _stats.items():
+            result[operation] = {
+                'calls': values['calls'],
+                'total_time': round(values['total_time'], 6),
+                'max_time': round(values['max_time'], 6),
+                'avg_time': round(values['total_time'] / values['calls'], 6) if values['calls'] else 0.0,
+            }
+        return result
+
+
+def shutdown():
+    with _executor_lock:
+        if _executor is not None and _executor_pid == os.getpid():
+            _executor.shutdown(wait=False, cancel_futures=True)
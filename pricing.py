@@ -0,0 +1,103 @@
+import os
+from datetime import date
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+
+# Porcentaje de IVA y si los precios de PRECIO ya lo incluyen (precio de góndola)
+IVA_PORCENTAJE = Decimal(os.getenv('IVA_PORCENTAJE', '19'))
+PRECIOS_INCLUYEN_IVA = os.getenv('PRECIOS_INCLUYEN_IVA', 'true').lower() == 'true'
+# Decimales de los montos (0 para pesos chilenos)
+PRECIO_DECIMALES = int(os.getenv('PRECIO_DECIMALES', 0))
+
+CIEN = Decimal(100)
+
+
+class PricingError(Exception):
+    # Se lanza cuando algún producto no existe o no tiene precio
+    def __init__(self, productos):
+        super().__init__('Productos sin precio')
+        self.productos = productos
+
+
+def _redondear(monto):
+    return monto.quantize(Decimal(1).scaleb(-PRECIO_DECIMALES), rounding=ROUND_HALF_UP)
+
+
+def _decimal(valor):
+    return valor if isinstance(valor, Decimal) else Decimal(str(valor))
+
+
+# Precio y descuento vigente de cada producto con una sola consulta.
+# Un descuento sin fecha de vencimiento no vence.
+def _cargar_precios(cursor, ids, hoy):
+    placeholders = ', '.join(['%s'] * len(ids))
+    cursor.execute(f'''
+        SELECT
+            p.id_producto,
+            p.nombre,
+            pr.precio_venta,
+            MAX(d.porcentaje) AS descuento
+        FROM PRODUCTOS p
+        LEFT JOIN PRECIO pr ON p.id_producto = pr.id_producto
+        LEFT JOIN DESCUENTOS d ON p.id_producto = d.id_producto
+            AND (d.vencimiento_descuento IS NULL OR d.vencimiento_descuento >= %s)
+        WHERE p.id_producto IN ({placeholders})
+        GROUP BY p.id_producto, p.nombre, pr.precio_venta
+    ''', (hoy, *ids))
+    return {row['id_producto']: row for row in cursor.fetchall()}
+
+
+# Calcular los montos de una canasta de pares (id_producto, cantidad). Cada línea se
+# redondea a PRECIO_DECIMALES y los totales se calculan a partir de la suma de las líneas.
+def cotizar(cursor, detalles, hoy=None):
+    ids = sorted({id_producto for id_producto, _ in detalles})
+    precios = _cargar_precios(cursor, ids, hoy or date.today())
+
+    invalidos = [id_producto for id_producto in ids
+                 if id_producto not in precios or precios[id_producto]['precio_venta'] is None]
+    if invalidos:
+        raise PricingError(invalidos)
+
+    lineas = []
+    suma = Decimal(0)
+    for id_producto, cantidad in detalles:
+        fila = precios[id_producto]
+        cantidad = _decimal(cantidad)
+        precio = _decimal(fila['precio_venta'])
+        descuento = _decimal(fila['descuento'] or 0)
+        precio_final = precio * (CIEN - descuento) / CIEN
+        total_linea = _redondear(precio_final * cantidad)
+        suma += total_linea
+        lineas.append({
+            'id_producto': id_producto,
+            'nombre': fila['nombre'],
+            'cantidad': cantidad,
+            'precio_unitario': precio,
+            'descuento': descuento,
+            'precio_final': _redondear(precio_final),
+            'total': total_linea,
+        })
+
+    tasa = IVA_PORCENTAJE / CIEN
+    if PRECIOS_INCLUYEN_IVA:
+        total_con_iva = suma
+        total_sin_iva = _redondear(suma / (1 + tasa))
+    else:
+        total_sin_iva = suma
+        total_con_iva = suma + _redondear(suma * tasa)
+
+    return {
+        'productos': lineas,
+        'porcentaje_iva': IVA_PORCENTAJE,
+        'precios_incluyen_iva': PRECIOS_INCLUYEN_IVA,
+        'total_sin_iva': total_sin_iva,
+        'iva': total_con_iva - total_sin_iva,
+        'total_con_iva': total_con_iva,
+    }
+
+
+# Indica si un monto enviado por la caja no coincide con el calculado
+def difiere(enviado, calculado):
+    try:
+        return _decimal(enviado) != calculado
+    except InvalidOperation:
+        return True
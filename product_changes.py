@@ -0,0 +1,90 @@
+import threading
+import time
+import table_versions
+
+# Registro de cambios del catálogo de productos para la sincronización
+# incremental (ver migrations/003_cambios_producto.sql). CAMBIOSPRODUCTO guarda
+# una fila por producto con la versión de su último cambio; los productos
+# inactivos quedan marcados como eliminados.
+
+CHUNK_SIZE = 1000
+
+
+# Marcar los productos como modificados en la transacción actual y devolver
+# la nueva versión del catálogo. Se llama justo antes del commit.
+def registrar(cursor, ids_producto):
+    version = table_versions.incrementar(cursor, 'productos')['productos']
+
+    ids = sorted({int(id_producto) for id_producto in ids_producto})
+    for inicio in range(0, len(ids), CHUNK_SIZE):
+        lote = ids[inicio:inicio + CHUNK_SIZE]
+        placeholders = ', '.join(['%s'] * len(lote))
+        cursor.execute(f'''
+            INSERT INTO CAMBIOSPRODUCTO (id_producto, version, eliminado)
+            SELECT p.id_producto, %s, COALESCE(e.estado = 'inactivo', 0)
+            FROM PRODUCTOS p
+            LEFT JOIN ESTADO e ON p.id_estado = e.id_estado
+            WHERE p.id_producto IN ({placeholders})
+            ON DUPLICATE KEY UPDATE version = VALUES(version), eliminado = VALUES(eliminado)
+        ''', [version, *lote])
+    return version
+
+
+# Versión actual del catálogo de productos
+def version_actual(cursor):
+    cursor.execute("SELECT version FROM VERSIONTABLA WHERE tabla = 'productos'")
+    row = cursor.fetchone()
+    return row['version'] if row else 0
+
+
+# Versión del último cambio de cada producto, vista por este proceso. Cada `ttl`
+# segundos se leen de CAMBIOSPRODUCTO solo los cambios posteriores a la última
+# lectura (índice idx_cambios_version), de modo que las escrituras de otros procesos
+# invalidan únicamente los productos que cambiaron.
+class ProductVersions:
+    def __init__(self, get_connection, ttl=1):
+        self._get_connection = get_connection
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._versions = {}  # id_producto -> versión de su último cambio visto
+        self._seen = None  # mayor versión leída de CAMBIOSPRODUCTO
+        self._loaded_at = None
+
+    def _load(self):
+        connection = self._get_connection()
+        try:
+            with connection.cursor() as cursor:
+                if self._seen is None:
+                    # Al iniciar basta con la versión actual: la caché todavía está vacía
+                    cursor.execute('SELECT COALESCE(MAX(version), 0) AS version FROM CAMBIOSPRODUCTO')
+                    cambios = []
+                    seen = cursor.fetchone()['version']
+                else:
+                    cursor.execute('''
+                        SELECT id_producto, version FROM CAMBIOSPRODUCTO
+                        WHERE version > %s
+                        ORDER BY version
+                    ''', (self._seen,))
+                    cambios = cursor.fetchall()
+                    seen = cambios[-1]['version'] if cambios else self._seen
+        finally:
+            connection.close()
+
+        with self._lock:
+            for cambio in cambios:
+                self._versions[cambio['id_producto']] = cambio['version']
+            self._seen = max(seen, self._seen or 0)
+            self._loaded_at = time.monotonic()
+
+    def refresh(self):
+        if self._loaded_at is None or time.monotonic() - self._loaded_at > self.ttl:
+            self._load()
+
+    # Indica si un valor leído con la versión `version` del producto quedó desactualizado
+    def is_stale(self, id_producto, version):
+        return self._versions.get(id_producto, 0) > (version or 0)
+
+    # Forzar la lectura de cambios después de una escritura hecha por este proceso
+    def invalidate(self):
+        with self._lock:
+            self._loaded_at = None
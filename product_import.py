@@ -0,0 +1,158 @@
+import csv
+import io
+import os
+import product_changes
+
+IMPORT_CHUNK_SIZE = int(os.getenv('IMPORT_CHUNK_SIZE', 500))
+IMPORT_MAX_ROWS = int(os.getenv('IMPORT_MAX_ROWS', 50000))
+
+_ids_consecutivos = None
+
+
+class ProductImportError(ValueError):
+    pass
+
+
+# Leer las filas a importar desde un arreglo JSON o un archivo CSV
+# (campo `archivo` de un formulario multipart, o el cuerpo con Content-Type text/csv)
+def leer_filas(request):
+    if request.files.get('archivo'):
+        contenido = request.files['archivo'].read().decode('utf-8-sig')
+        filas = _leer_csv(contenido)
+    elif request.mimetype == 'text/csv':
+        filas = _leer_csv(request.get_data(as_text=True))
+    else:
+        filas = request.get_json(silent=True)
+        if not isinstance(filas, list):
+            raise ProductImportError('Se espera un arreglo JSON de productos o un archivo CSV')
+
+    if not filas:
+        raise ProductImportError('No se recibieron productos para importar')
+    if len(filas) > IMPORT_MAX_ROWS:
+        raise ProductImportError(f'Se permiten como máximo {IMPORT_MAX_ROWS} productos por importación')
+    return filas
+
+
+def _leer_csv(contenido):
+    lector = csv.DictReader(io.StringIO(contenido))
+    # Las celdas vacías se tratan como datos no proporcionados
+    return [{clave: (valor if valor != '' else None) for clave, valor in fila.items()} for fila in lector]
+
+
+# Con innodb_autoinc_lock_mode 0 o 1, un INSERT de varias filas recibe ids
+# consecutivos; con el modo 2 los ids pueden intercalarse con otras sesiones.
+def _usar_ids_consecutivos(cursor):
+    global _ids_consecutivos
+    if _ids_consecutivos is None:
+        try:
+            cursor.execute('SELECT @@innodb_autoinc_lock_mode AS modo')
+            _ids_consecutivos = int(cursor.fetchone()['modo']) in (0, 1)
+        except Exception:
+            _ids_consecutivos = False
+    return _ids_consecutivos
+
+
+def _insertar_productos(cursor, productos):
+    filas = [
+        (p['nombre'], p['descripcion'], p['fecha_vencimiento'], p['id_estado'], p['id_categoria'])
+        for p in productos
+    ]
+    query = '''
+        INSERT INTO PRODUCTOS (nombre, descripcion, fecha_registro, fecha_vencimiento, id_estado, id_categoria)
+        VALUES {valores}
+    '''
+    valor = '(%s, %s, current_timestamp(), %s, %s, %s)'
+
+    if _usar_ids_consecutivos(cursor):
+        # Una única sentencia (executemany podría dividirla), cuyo primer id es lastrowid
+        cursor.execute(query.format(valores=', '.join([valor] * len(filas))), [v for fila in filas for v in fila])
+        primer_id = cursor.lastrowid
+        return list(range(primer_id, primer_id + len(filas)))
+
+    query = query.format(valores=valor)
+    ids = []
+    for fila in filas:
+        cursor.execute(query, fila)
+        ids.append(cursor.lastrowid)
+    return ids
+
+
+# Insertar un lote de productos ya validados en una sola transacción, que también
+# registra los cambios para que la sincronización incremental vea el lote confirmado
+def _insertar_lote(connection, productos):
+    with connection.cursor() as cursor:
+        ids = _insertar_productos(cursor, productos)
+
+        cursor.executemany(
+            'INSERT INTO CODIGOBARRAS (codigo, id_producto) VALUES (%s, %s)',
+            [(p['codigo_barras'], id_producto) for p, id_producto in zip(productos, ids)]
+        )
+        cursor.executemany(
+            'INSERT INTO STOCK (id_producto, stock) VALUES (%s, %s)',
+            [(id_producto, p['stock']) for p, id_producto in zip(productos, ids)]
+        )
+        descuentos = [
+            (id_producto, p['descuento'], p['vencimiento_descuento'])
+            for p, id_producto in zip(productos, ids) if p['descuento']
+        ]
+        if descuentos:
+            cursor.executemany(
+                'INSERT INTO DESCUENTOS (id_producto, porcentaje, vencimiento_descuento) VALUES (%s, %s, %s)',
+                descuentos
+            )
+        cursor.executemany(
+            'INSERT INTO PRECIO (id_producto, precio_venta) VALUES (%s, %s)',
+            [(id_producto, p['precio_venta']) for p, id_producto in zip(productos, ids)]
+        )
+        product_changes.registrar(cursor, ids)
+    connection.commit()
+    return ids
+
+
+# Buscar cuáles de los códigos de barras ya están registrados
+def _codigos_existentes(connection, codigos):
+    placeholders = ', '.join(['%s'] * len(codigos))
+    with connection.cursor() as cursor:
+        cursor.execute(f'SELECT codigo FROM CODIGOBARRAS WHERE codigo IN ({placeholders})', codigos)
+        return {row['codigo'] for row in cursor.fetchall()}
+
+
+# Importar productos validados. `productos` es una lista de (número de fila, producto).
+# Devuelve los ids insertados por fila y la lista de errores por fila.
+def importar_productos(connection, productos, chunk_size=IMPORT_CHUNK_SIZE):
+    insertados = {}
+    errores = []
+
+    for inicio in range(0, len(productos), chunk_size):
+        lote = productos[inicio:inicio + chunk_size]
+
+        existentes = _codigos_existentes(connection, [p['codigo_barras'] for _, p in lote])
+        validos = []
+        for fila, producto in lote:
+            if producto['codigo_barras'] in existentes:
+                errores.append({"fila": fila, "codigo_barras": producto['codigo_barras'], "error": "El código de barras ya existe"})
+            else:
+                validos.append((fila, producto))
+        if not validos:
+            continue
+
+        try:
+            ids = _insertar_lote(connection, [producto for _, producto in validos])
+        except Exception as e:
+            connection.rollback()
+            print(f"Error al importar un lote de productos, se reintenta fila por fila: {e}")
+            ids = []
+            # Reintentar cada fila por separado para identificar las que fallan
+            for fila, producto in validos:
+                try:
+                    ids.extend(_insertar_lote(connection, [producto]))
+                except Exception as e:
+                    connection.rollback()
+                    ids.append(None)
+                    errores.append({"fila": fila, "codigo_barras": producto['codigo_barras'], "error": str(e)})
+
+        for (fila, _), id_producto in zip(validos, ids):
+            if id_producto is not None:
+                insertados[fila] = id_producto
+
+    return insertados, errores
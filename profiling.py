@@ -0,0 +1,140 @@
+import cProfile
+import hmac
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from flask import g, request
+
+# Perfilado bajo demanda: una solicitud se perfila si trae el encabezado
+# X-Profile con el valor de PROFILE_TOKEN, o al azar con probabilidad PROFILE_SAMPLE_RATE
+PROFILE_TOKEN = os.getenv('PROFILE_TOKEN')
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', 0))
+PROFILE_DIR = os.getenv('PROFILE_DIR', 'profiles')
+# Intervalo en segundos entre muestras de la pila para el archivo .folded
+PROFILE_STACK_INTERVAL = float(os.getenv('PROFILE_STACK_INTERVAL', 0.005))
+
+# Solo se perfila una solicitud a la vez por proceso: desde Python 3.12 cProfile
+# admite un único perfil activo (un segundo enable() lanza ValueError), y con
+# eventlet las solicitudes comparten el hilo del sistema y se mezclarían
+_active = threading.Lock()
+
+
+# Toma muestras periódicas de la pila de un hilo. El resultado está en el formato
+# "pilas colapsadas" que aceptan flamegraph.pl y speedscope.
+class StackSampler(threading.Thread):
+    def __init__(self, thread_id, interval):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})')
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+    def folded(self):
+        return ''.join(f'{stack} {count}\n' for stack, count in self.stacks.most_common())
+
+
+# Con eventlet o gevent (el worker de producción) los hilos son greenlets:
+# threading.get_ident() no identifica un hilo del sistema y sys._current_frames()
+# no ve sus pilas, por lo que el muestreo no se puede hacer
+def _green_threads():
+    patcher = sys.modules.get('eventlet.patcher')
+    if patcher is not None and patcher.is_monkey_patched('thread'):
+        return True
+    monkey = sys.modules.get('gevent.monkey')
+    return monkey is not None and monkey.is_module_patched('threading')
+
+
+def _requested():
+    header = request.headers.get('X-Profile')
+    if header and PROFILE_TOKEN and hmac.compare_digest(header, PROFILE_TOKEN):
+        return True
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+
+def _before_request():
+    if not _requested():
+        return
+    if not _active.acquire(blocking=False):
+        print(f"Ya hay una solicitud en perfilado, se omite el perfil de {request.path}")
+        return
+    try:
+        profile = cProfile.Profile()
+        sampler = None if _green_threads() else StackSampler(threading.get_ident(), PROFILE_STACK_INTERVAL)
+        if sampler is not None:
+            sampler.start()
+        g._profile = (profile, sampler, time.perf_counter())
+        profile.enable()
+    except Exception:
+        _stop(g.pop('_profile', None))
+        _active.release()
+        raise
+
+
+def _stop(active):
+    if active is None:
+        return
+    active[0].disable()
+    if active[1] is not None:
+        active[1].stop()
+
+
+# Guardar el perfil (.prof, para pstats o snakeviz) y las pilas (.folded, para flamegraph.pl)
+def _after_request(response):
+    active = g.pop('_profile', None)
+    if active is None:
+        return response
+
+    profile, sampler, start = active
+    try:
+        _stop(active)
+    finally:
+        _active.release()
+    elapsed_ms = int((time.perf_counter() - start) * 1000)
+
+    endpoint = re.sub(r'[^A-Za-z0-9_-]', '_', request.endpoint or 'desconocido')
+    name = f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{endpoint}-{elapsed_ms}ms"
+    try:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        profile.dump_stats(os.path.join(PROFILE_DIR, name + '.prof'))
+        if sampler is not None:
+            with open(os.path.join(PROFILE_DIR, name + '.folded'), 'w', encoding='utf-8') as f:
+                f.write(sampler.folded())
+        response.headers['X-Profile-Id'] = name
+    except OSError as e:
+        print(f"No se pudo guardar el perfil de la solicitud: {e}")
+    return response
+
+
+# Si la solicitud terminó con una excepción no hubo after_request: detener el perfil
+def _teardown_request(exc):
+    active = g.pop('_profile', None)
+    if active is not None:
+        try:
+            _stop(active)
+        finally:
+            _active.release()
+
+
+def init_profiling(app):
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.teardown_request(_teardown_request)
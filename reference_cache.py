@@ -0,0 +1,90 @@
+import threading
+import time
+
+# Tablas de referencia: nombre lógico -> (tabla, columna id, columna nombre)
+REFERENCE_TABLES = {
+    'estado': ('ESTADO', 'id_estado', 'estado'),
+    'tipo_usuario': ('TIPOUSUARIO', 'id_tipo_usuario', 'tipo'),
+    'categoria': ('CATEGORIA', 'id_categoria', 'nombre_categoria'),
+    'forma_pago': ('FORMAPAGO', 'id_forma_pago', 'metodo'),
+    'tipo_documento': ('TIPODOCUMENTO', 'id_tipodocumento', 'nombre'),
+}
+
+
+# MySQL compara estos nombres sin distinguir mayúsculas ni espacios finales
+def _normalize(name):
+    return str(name).rstrip().lower()
+
+
+# Caché en memoria de las tablas de referencia con mapas nombre <-> id
+class ReferenceCache:
+    def __init__(self, get_connection, ttl=600, miss_refresh_interval=5):
+        self._get_connection = get_connection
+        self.ttl = ttl
+        self.miss_refresh_interval = miss_refresh_interval
+        self._lock = threading.Lock()
+        self._by_name = {}
+        self._by_id = {}
+        self._loaded_at = {}
+
+    def _load(self, key):
+        table, id_column, name_column = REFERENCE_TABLES[key]
+        connection = self._get_connection()
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(f'SELECT {id_column}, {name_column} FROM {table}')
+                rows = cursor.fetchall()
+        finally:
+            connection.close()
+
+        by_name = {_normalize(row[name_column]): row[id_column] for row in rows}
+        by_id = {row[id_column]: row[name_column] for row in rows}
+        with self._lock:
+            self._by_name[key] = by_name
+            self._by_id[key] = by_id
+            self._loaded_at[key] = time.monotonic()
+
+    # invalidate() puede quitar la marca en cualquier momento desde otro hilo:
+    # una tabla sin marca se considera vencida
+    def _is_stale(self, key, max_age):
+        loaded_at = self._loaded_at.get(key)
+        return loaded_at is None or time.monotonic() - loaded_at > max_age
+
+    def _ensure(self, key):
+        if self._is_stale(key, self.ttl):
+            self._load(key)
+
+    # Cargar todas las tablas (se usa al iniciar la aplicación)
+    def load_all(self):
+        for key in REFERENCE_TABLES:
+            self._load(key)
+
+    def invalidate(self, key=None):
+        with self._lock:
+            if key is None:
+                self._loaded_at.clear()
+            else:
+                self._loaded_at.pop(key, None)
+
+    # Obtener el id a partir del nombre. Devuelve None si no existe.
+    def get_id(self, key, name):
+        if name is None:
+            return None
+        self._ensure(key)
+        value = self._by_name[key].get(_normalize(name))
+        if value is None and self._is_stale(key, self.miss_refresh_interval):
+            # Puede que otro proceso haya insertado la fila recientemente
+            self._load(key)
+            value = self._by_name[key].get(_normalize(name))
+        return value
+
+    # Obtener el nombre a partir del id. Devuelve None si no existe.
+    def get_name(self, key, id_value):
+        if id_value is None:
+            return None
+        self._ensure(key)
+        value = self._by_id[key].get(id_value)
+        if value is None and self._is_stale(key, self.miss_refresh_interval):
+            self._load(key)
+            value = self._by_id[key].get(id_value)
+        return value
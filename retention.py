@@ -0,0 +1,206 @@
+import gzip
+import json
+import os
+import time
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from leader_lock import leader_lock
+
+# Retención del historial: las filas más antiguas que el horizonte se mueven de
+# REGISTROHISTORIAL y VENTA (con su DETALLEVENTA) a archivos NDJSON comprimidos,
+# uno por mes: ARCHIVE_DIR/<tabla>/AAAA-MM.ndjson.gz
+RETENTION_ENABLED = os.getenv('RETENTION_ENABLED', '0') == '1'
+# Días de historial que se conservan en la base de datos (0 desactiva la tabla)
+RETENTION_REGISTROS_DAYS = int(os.getenv('RETENTION_REGISTROS_DAYS', 365))
+RETENTION_VENTAS_DAYS = int(os.getenv('RETENTION_VENTAS_DAYS', 730))
+RETENTION_BATCH_SIZE = int(os.getenv('RETENTION_BATCH_SIZE', 1000))
+# Hora diaria de ejecución (HH:MM)
+RETENTION_TIME = os.getenv('RETENTION_TIME', '03:30')
+ARCHIVE_DIR = os.getenv('ARCHIVE_DIR', 'archive')
+
+LOCK_NAME = 'sellify_retencion'
+
+# Tabla archivada -> (directorio, columna de fecha, columna id)
+ARCHIVES = {
+    'registros': ('registros', 'fecha_y_hora', 'id_registro'),
+    'ventas': ('ventas', 'fecha_venta', 'id_venta'),
+}
+
+
+def _default(o):
+    if isinstance(o, (date, datetime)):
+        return o.isoformat()
+    if isinstance(o, Decimal):
+        return str(o)
+    raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
+
+
+# Inicio del día a partir del cual se conservan las filas. Se archivan días
+# completos para que los resúmenes diarios de ventas sigan siendo exactos.
+def corte(dias, hoy=None):
+    return datetime.combine((hoy or date.today()) - timedelta(days=dias), datetime.min.time())
+
+
+def _ruta(tabla, mes):
+    return os.path.join(ARCHIVE_DIR, ARCHIVES[tabla][0], f'{mes}.ndjson.gz')
+
+
+# Agregar filas a los archivos de su mes. Cada lote se escribe como un miembro gzip
+# nuevo (gzip lee los miembros concatenados como un solo archivo) y se sincroniza
+# con el disco antes de borrar las filas de la base de datos.
+def _escribir(tabla, filas):
+    columna_fecha = ARCHIVES[tabla][1]
+    por_mes = {}
+    for fila in filas:
+        por_mes.setdefault(fila[columna_fecha].strftime('%Y-%m'), []).append(fila)
+
+    for mes, grupo in por_mes.items():
+        ruta = _ruta(tabla, mes)
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        data = ''.join(json.dumps(fila, default=_default, ensure_ascii=False) + '\n' for fila in grupo)
+        with open(ruta, 'ab') as f:
+            f.write(gzip.compress(data.encode('utf-8')))
+            f.flush()
+            os.fsync(f.fileno())
+
+
+def _placeholders(valores):
+    return ', '.join(['%s'] * len(valores))
+
+
+# Mover a los archivos los registros anteriores a `hasta`, en lotes de `batch_size`
+def archivar_registros(connection, hasta, batch_size=RETENTION_BATCH_SIZE):
+    total = 0
+    while True:
+        with connection.cursor() as cursor:
+            cursor.execute('''
+                SELECT id_registro, mensaje, fecha_y_hora, tipo, descripcion, usuario
+                FROM REGISTROHISTORIAL
+                WHERE fecha_y_hora < %s
+                ORDER BY fecha_y_hora, id_registro
+                LIMIT %s
+            ''', (hasta, batch_size))
+            filas = cursor.fetchall()
+            if not filas:
+                break
+
+            _escribir('registros', filas)
+            ids = [fila['id_registro'] for fila in filas]
+            cursor.execute(f'DELETE FROM REGISTROHISTORIAL WHERE id_registro IN ({_placeholders(ids)})', ids)
+        connection.commit()
+
+        total += len(filas)
+        if len(filas) < batch_size:
+            break
+    return total
+
+
+# Mover a los archivos las ventas anteriores a `hasta` junto con sus detalles
+def archivar_ventas(connection, hasta, batch_size=RETENTION_BATCH_SIZE):
+    total = 0
+    while True:
+        with connection.cursor() as cursor:
+            cursor.execute('''
+                SELECT * FROM VENTA
+                WHERE fecha_venta < %s
+                ORDER BY fecha_venta, id_venta
+                LIMIT %s
+            ''', (hasta, batch_size))
+            ventas = cursor.fetchall()
+            if not ventas:
+                break
+
+            ids = [venta['id_venta'] for venta in ventas]
+            cursor.execute(f'SELECT * FROM DETALLEVENTA WHERE id_venta IN ({_placeholders(ids)})', ids)
+            detalles = {}
+            for detalle in cursor.fetchall():
+                detalles.setdefault(detalle['id_venta'], []).append(detalle)
+            for venta in ventas:
+                venta['detalles'] = detalles.get(venta['id_venta'], [])
+
+            _escribir('ventas', ventas)
+            cursor.execute(f'DELETE FROM DETALLEVENTA WHERE id_venta IN ({_placeholders(ids)})', ids)
+            cursor.execute(f'DELETE FROM VENTA WHERE id_venta IN ({_placeholders(ids)})', ids)
+        connection.commit()
+
+        total += len(ventas)
+        if len(ventas) < batch_size:
+            break
+    return total
+
+
+# Tarea de retención. Con varios workers solo la ejecuta el que obtiene el bloqueo.
+def ejecutar(get_connection):
+    connection = get_connection()
+    inicio = time.monotonic()
+    try:
+        with leader_lock(connection, LOCK_NAME) as lider:
+            if not lider:
+                print("La retención ya se está ejecutando en otro proceso")
+                return None
+
+            registros = archivar_registros(connection, corte(RETENTION_REGISTROS_DAYS)) if RETENTION_REGISTROS_DAYS else 0
+            ventas = archivar_ventas(connection, corte(RETENTION_VENTAS_DAYS)) if RETENTION_VENTAS_DAYS else 0
+
+        duracion = time.monotonic() - inicio
+        print(f"Retención completada: {registros} registros y {ventas} ventas archivados en {duracion:.1f} s")
+        return {'registros': registros, 'ventas': ventas, 'duracion': round(duracion, 3)}
+    except Exception as e:
+        connection.rollback()
+        print(f"Error durante la retención: {e}")
+        return None
+    finally:
+        connection.close()
+
+
+# Las fechas archivadas son texto ISO: 'AAAA-MM-DD' si la columna es DATE o
+# 'AAAA-MM-DDTHH:MM:SS' si es DATETIME. Se comparan como datetime para que un DATE
+# no quede antes que la medianoche del mismo día.
+def _como_datetime(valor):
+    if isinstance(valor, str):
+        return datetime.fromisoformat(valor)
+    if isinstance(valor, datetime):
+        return valor
+    return datetime.combine(valor, datetime.min.time())
+
+
+def _meses(tabla):
+    directorio = os.path.join(ARCHIVE_DIR, ARCHIVES[tabla][0])
+    if not os.path.isdir(directorio):
+        return []
+    return sorted(nombre[:7] for nombre in os.listdir(directorio) if nombre.endswith('.ndjson.gz'))
+
+
+# Leer del archivo las filas con fecha en [desde, hasta) que cumplan `filtro`.
+# Solo se abren los archivos de los meses del rango.
+def leer(tabla, desde=None, hasta=None, filtro=None):
+    columna_fecha, columna_id = ARCHIVES[tabla][1], ARCHIVES[tabla][2]
+    desde = _como_datetime(desde) if desde else None
+    hasta = _como_datetime(hasta) if hasta else None
+
+    for mes in _meses(tabla):
+        if desde and mes < desde.strftime('%Y-%m'):
+            continue
+        if hasta and mes > hasta.strftime('%Y-%m'):
+            break
+
+        # Si la retención se interrumpió entre escribir y borrar, un lote puede repetirse
+        vistos = set()
+        try:
+            with gzip.open(_ruta(tabla, mes), 'rt', encoding='utf-8') as f:
+                for linea in f:
+                    fila = json.loads(linea)
+                    if fila[columna_id] in vistos:
+                        continue
+                    vistos.add(fila[columna_id])
+                    fecha = _como_datetime(fila[columna_fecha])
+                    if desde and fecha < desde:
+                        continue
+                    if hasta and fecha >= hasta:
+                        continue
+                    if filtro and not filtro(fila):
+                        continue
+                    yield fila
+        except (EOFError, gzip.BadGzipFile, json.JSONDecodeError) as e:
+            # Un lote escrito a medias al final del archivo
+            print(f"Archivo {_ruta(tabla, mes)} incompleto, se omite el resto: {e}")
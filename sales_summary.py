@@ -0,0 +1,70 @@
+# Resúmenes diarios de ventas por cajero y por cliente (ver migrations/001_resumen_ventas.sql)
+from datetime import date
+
+
+# Sumar una venta a los resúmenes del día, dentro de la transacción que la registra
+def registrar_venta(cursor, id_venta, id_cliente, id_cajero, total_con_iva, fecha_venta):
+    # id_venta_maxima se asigna antes que venta_maxima porque MySQL aplica
+    # las asignaciones en orden y la comparación debe usar el máximo anterior
+    cursor.execute('''
+        INSERT INTO RESUMENVENTACAJERO (fecha, id_cajero, numero_ventas, total_ventas, venta_maxima, id_venta_maxima)
+        VALUES (DATE(%s), %s, 1, %s, %s, %s)
+        ON DUPLICATE KEY UPDATE
+            id_venta_maxima = IF(VALUES(venta_maxima) > venta_maxima, VALUES(id_venta_maxima), id_venta_maxima),
+            venta_maxima = GREATEST(venta_maxima, VALUES(venta_maxima)),
+            numero_ventas = numero_ventas + 1,
+            total_ventas = total_ventas + VALUES(total_ventas)
+    ''', (fecha_venta, id_cajero, total_con_iva, total_con_iva, id_venta))
+
+    cursor.execute('''
+        INSERT INTO RESUMENVENTACLIENTE (fecha, id_cliente, numero_ventas, total_ventas)
+        VALUES (DATE(%s), %s, 1, %s)
+        ON DUPLICATE KEY UPDATE
+            numero_ventas = numero_ventas + 1,
+            total_ventas = total_ventas + VALUES(total_ventas)
+    ''', (fecha_venta, id_cliente, total_con_iva))
+
+
+# Recalcular los resúmenes desde la tabla VENTA (todos, o desde la fecha `desde`).
+# Las ventas archivadas (ver retention.py) ya no están en VENTA, por lo que los días
+# anteriores a la venta más antigua conservan el resumen que tenían.
+def reconstruir(connection, desde=None):
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT DATE(MIN(fecha_venta)) AS minimo FROM VENTA')
+        minimo = cursor.fetchone()['minimo']
+    if minimo is None:
+        return 0, 0
+
+    if desde:
+        desde = max(date.fromisoformat(str(desde)), minimo)
+    else:
+        desde = minimo
+    filtro_resumen = ' WHERE fecha >= %s'
+    filtro_venta = ' WHERE fecha_venta >= %s'
+    params = (desde,)
+
+    with connection.cursor() as cursor:
+        cursor.execute('DELETE FROM RESUMENVENTACAJERO' + filtro_resumen, params)
+        cursor.execute('''
+            INSERT INTO RESUMENVENTACAJERO (fecha, id_cajero, numero_ventas, total_ventas, venta_maxima, id_venta_maxima)
+            SELECT
+                DATE(fecha_venta),
+                id_cajero,
+                COUNT(*),
+                SUM(total_con_iva),
+                MAX(total_con_iva),
+                CAST(SUBSTRING_INDEX(GROUP_CONCAT(id_venta ORDER BY total_con_iva DESC, id_venta), ',', 1) AS UNSIGNED)
+            FROM VENTA
+        ''' + filtro_venta + ' GROUP BY DATE(fecha_venta), id_cajero', params)
+        filas_cajero = cursor.rowcount
+
+        cursor.execute('DELETE FROM RESUMENVENTACLIENTE' + filtro_resumen, params)
+        cursor.execute('''
+            INSERT INTO RESUMENVENTACLIENTE (fecha, id_cliente, numero_ventas, total_ventas)
+            SELECT DATE(fecha_venta), id_cliente, COUNT(*), SUM(total_con_iva)
+            FROM VENTA
+        ''' + filtro_venta + ' GROUP BY DATE(fecha_venta), id_cliente', params)
+        filas_cliente = cursor.rowcount
+
+    connection.commit()
+    return filas_cajero, filas_cliente
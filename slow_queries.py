@@ -0,0 +1,100 @@
+import hashlib
+import os
+import re
+import threading
+import time
+from collections import deque
+from datetime import datetime
+import pymysql.cursors
+
+# Umbral en milisegundos a partir del cual una consulta se registra como lenta (0 lo desactiva)
+SLOW_QUERY_MS = float(os.getenv('SLOW_QUERY_MS', 500))
+# Incluir el plan de ejecución (EXPLAIN) de las consultas lentas
+SLOW_QUERY_EXPLAIN = os.getenv('SLOW_QUERY_EXPLAIN', '1') != '0'
+# Segundos mínimos entre dos EXPLAIN de la misma consulta, para no sumar carga a una consulta ya lenta
+SLOW_QUERY_EXPLAIN_INTERVAL = float(os.getenv('SLOW_QUERY_EXPLAIN_INTERVAL', 300))
+SLOW_QUERY_HISTORY = int(os.getenv('SLOW_QUERY_HISTORY', 100))
+
+_EXPLAINABLE = re.compile(r'^\s*(SELECT|WITH|UPDATE|DELETE)\b', re.IGNORECASE)
+
+_lock = threading.Lock()
+_history = deque(maxlen=SLOW_QUERY_HISTORY)
+_explained_at = {}  # huella de la consulta -> último EXPLAIN
+
+
+def is_slow(elapsed):
+    return SLOW_QUERY_MS > 0 and elapsed * 1000 >= SLOW_QUERY_MS
+
+
+# Texto de la consulta sin los valores, con los espacios normalizados
+def _normalize(query):
+    return ' '.join(query.split())
+
+
+# Tipos y cantidad de los parámetros, sin sus valores (pueden contener datos personales)
+def describe_params(args):
+    if args is None:
+        return 'sin parámetros'
+    if isinstance(args, dict):
+        return '{' + ', '.join(f'{key}: {type(value).__name__}' for key, value in args.items()) + '}'
+    if not isinstance(args, (list, tuple)):
+        return type(args).__name__
+
+    # Los tipos consecutivos iguales se agrupan (las listas IN pueden tener miles de elementos)
+    groups = []
+    for value in args:
+        name = type(value).__name__
+        if groups and groups[-1][0] == name:
+            groups[-1][1] += 1
+        else:
+            groups.append([name, 1])
+    types = ', '.join(name if count == 1 else f'{name} x{count}' for name, count in groups)
+    return f'{len(args)} parámetros: {types}'
+
+
+def _explain(cursor, query, args):
+    # Un cursor de streaming deja la conexión ocupada hasta leer todas sus filas
+    if not SLOW_QUERY_EXPLAIN or isinstance(cursor, pymysql.cursors.SSCursor) or not _EXPLAINABLE.match(query):
+        return None
+
+    fingerprint = hashlib.sha1(_normalize(query).encode('utf-8')).hexdigest()
+    now = time.monotonic()
+    with _lock:
+        last = _explained_at.get(fingerprint)
+        if last is not None and now - last < SLOW_QUERY_EXPLAIN_INTERVAL:
+            return None
+        _explained_at[fingerprint] = now
+
+    try:
+        # Cursor sin instrumentar para que el EXPLAIN no cuente como consulta de la solicitud
+        with cursor.connection.cursor(pymysql.cursors.DictCursor) as explain_cursor:
+            explain_cursor.execute('EXPLAIN ' + cursor.mogrify(query, args))
+            return explain_cursor.fetchall()
+    except Exception as e:
+        return f'No se pudo obtener el plan: {e}'
+
+
+# Registrar una consulta lenta con su texto, la forma de sus parámetros, las filas y el plan
+def record(cursor, query, args, elapsed, rows, endpoint):
+    entry = {
+        'fecha': datetime.now().isoformat(timespec='seconds'),
+        'endpoint': endpoint,
+        'duracion_ms': round(elapsed * 1000, 2),
+        'filas': rows,
+        'sql': _normalize(query),
+        'parametros': describe_params(args),
+        'plan': _explain(cursor, query, args),
+    }
+    with _lock:
+        _history.append(entry)
+
+    print(f"Consulta lenta ({entry['duracion_ms']} ms, {rows if rows is not None else '?'} filas) en {endpoint}: "
+          f"{entry['sql']} | {entry['parametros']}")
+    if entry['plan']:
+        print(f"Plan de la consulta lenta: {entry['plan']}")
+
+
+# Últimas consultas lentas registradas, de la más reciente a la más antigua
+def recent():
+    with _lock:
+        return list(reversed(_history))
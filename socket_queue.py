@@ -0,0 +1,45 @@
+import queue
+import threading
+import socketio
+
+
+# Cola de mensajes en memoria para Socket.IO. Todos los servidores creados en el
+# mismo proceso con el mismo canal comparten las emisiones, igual que varios
+# workers conectados a Redis. Sirve en desarrollo para levantar varios servidores
+# en un solo proceso sin Redis. No sirve con SocketIO.test_client, que rechaza
+# cualquier cola de mensajes: las pruebas con el cliente de prueba se hacen sin cola.
+class LocalPubSubManager(socketio.PubSubManager):
+    name = 'local'
+
+    _buses = {}  # canal -> lista de colas de los servidores suscritos
+    _buses_lock = threading.Lock()
+
+    def __init__(self, channel='flask-socketio', write_only=False, logger=None):
+        super().__init__(channel=channel, write_only=write_only, logger=logger)
+        self._queue = queue.Queue()
+        if not write_only:
+            with self._buses_lock:
+                self._buses.setdefault(channel, []).append(self._queue)
+
+    def _publish(self, data):
+        message = self.json.dumps(data)
+        with self._buses_lock:
+            subscribers = list(self._buses.get(self.channel, ()))
+        for subscriber in subscribers:
+            subscriber.put(message)
+
+    def _listen(self):
+        while True:
+            yield self._queue.get()
+
+
+# Opciones de SocketIO según SOCKETIO_MESSAGE_QUEUE:
+#   - sin valor: un solo proceso, sin cola de mensajes
+#   - memory://: cola en memoria (desarrollo con varios servidores en un proceso)
+#   - redis://..., amqp://..., etc.: cola compartida entre procesos (producción)
+def socketio_queue_options(url, channel='flask-socketio'):
+    if not url:
+        return {}
+    if url.startswith('memory://'):
+        return {'client_manager': LocalPubSubManager(channel=channel)}
+    return {'message_queue': url, 'channel': channel}
@@ -0,0 +1,81 @@
+import threading
+import time
+
+
+# Nombre de la sala de Socket.IO asociada a un RUT
+def sala_rut(rut):
+    return f'rut:{rut}'
+
+
+# Registro de miembros y entregas por sala, para medir el costo de cada emisión
+class RoomMetrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._members = {}  # sala -> conjunto de sid
+        self._rooms_by_sid = {}  # sid -> conjunto de salas
+        self._emits = {}  # sala -> cantidad de emisiones
+        self._deliveries = {}  # sala -> mensajes entregados (emisiones x miembros)
+        self._last_emit = {}  # sala -> marca de tiempo
+
+    def join(self, sid, room):
+        with self._lock:
+            self._members.setdefault(room, set()).add(sid)
+            self._rooms_by_sid.setdefault(sid, set()).add(room)
+
+    def leave_all(self, sid):
+        with self._lock:
+            for room in self._rooms_by_sid.pop(sid, ()):
+                members = self._members.get(room)
+                if members is not None:
+                    members.discard(sid)
+                    if not members:
+                        del self._members[room]
+
+    def record_emit(self, room):
+        with self._lock:
+            self._emits[room] = self._emits.get(room, 0) + 1
+            self._deliveries[room] = self._deliveries.get(room, 0) + len(self._members.get(room, ()))
+            self._last_emit[room] = time.time()
+
+    def stats(self):
+        with self._lock:
+            rooms = set(self._members) | set(self._emits)
+            return {
+                'clients': len(self._rooms_by_sid),
+                'rooms': {
+                    room: {
+                        'members': len(self._members.get(room, ())),
+                        'emits': self._emits.get(room, 0),
+                        'deliveries': self._deliveries.get(room, 0),
+                        'last_emit': self._last_emit.get(room),
+                    }
+                    for room in sorted(rooms)
+                },
+            }
+
+
+# Descarta escaneos repetidos del mismo código para el mismo RUT dentro de una
+# ventana corta (lectores que envían el código dos veces, rebotes del gatillo)
+class ScanCoalescer:
+    def __init__(self, window=0.25):
+        self.window = window
+        self._lock = threading.Lock()
+        self._last_seen = {}  # (rut, código) -> marca de tiempo
+        self.coalesced = 0
+
+    # Devuelve True si el escaneo debe procesarse, False si es un duplicado
+    def accept(self, rut, barcode):
+        if not self.window:
+            return True
+        now = time.monotonic()
+        key = (rut, barcode)
+        with self._lock:
+            last = self._last_seen.get(key)
+            if last is not None and now - last < self.window:
+                self.coalesced += 1
+                return False
+            self._last_seen[key] = now
+            # Limpiar las entradas vencidas para que el diccionario no crezca sin límite
+            if len(self._last_seen) > 10000:
+                self._last_seen = {k: t for k, t in self._last_seen.items() if now - t < self.window}
+            return True
@@ -0,0 +1,77 @@
+from flask import Response, current_app, request, stream_with_context
+from config import get_db_connection
+from metrics import InstrumentedSSDictCursor
+
+EXPORT_MIMETYPES = {
+    'json': 'application/json',
+    'ndjson': 'application/x-ndjson',
+}
+
+
+class ExportError(ValueError):
+    pass
+
+
+# Leer el parámetro `export` de la solicitud. Devuelve None si no se pidió exportación.
+def get_export_format():
+    export = request.args.get('export')
+    if export is None:
+        return None
+    if export not in EXPORT_MIMETYPES:
+        raise ExportError(f"Formato de exportación no soportado: {export} (use json o ndjson)")
+    return export
+
+
+# Emitir los elementos como un arreglo JSON o como NDJSON, uno a la vez
+def _serialize(items, export_format):
+    dumps = current_app.json.dumps
+    if export_format == 'ndjson':
+        for item in items:
+            yield dumps(item) + '\n'
+    else:
+        yield '['
+        first = True
+        for item in items:
+            yield dumps(item) if first else ',' + dumps(item)
+            first = False
+        yield ']'
+
+
+def _streaming_response(generator, export_format):
+    response = Response(stream_with_context(generator), mimetype=EXPORT_MIMETYPES[export_format])
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
+# Respuesta en streaming a partir de un iterador de elementos (por ejemplo, leídos de un archivo)
+def stream_items(items, export_format):
+    return _streaming_response(_serialize(items, export_format), export_format)
+
+
+# Respuesta que recorre la consulta con un cursor del lado del servidor (sin
+# cargar todas las filas en memoria) y emite el JSON a medida que llegan.
+# `transform` recibe el iterador de filas y devuelve los elementos a emitir.
+def stream_query(query, params, export_format, transform=None):
+    def generate():
+        connection = get_db_connection()
+        finished = False
+        try:
+            cursor = connection.cursor(InstrumentedSSDictCursor)
+            cursor.execute(query, params)
+            items = transform(cursor) if transform else cursor
+            yield from _serialize(items, export_format)
+
+            cursor.close()
+            finished = True
+        except Exception as e:
+            print(f"Error durante la exportación: {e}")
+            raise
+        finally:
+            # Si la descarga se cortó quedan filas sin leer en el servidor: en lugar de
+            # leerlas para cerrar el cursor se descarta la conexión
+            if finished:
+                connection.close()
+            else:
+                connection.discard()
+
+    return _streaming_response(generate(), export_format)
@@ -0,0 +1,65 @@
+import hashlib
+import threading
+import time
+
+
+# Incrementar la versión de los catálogos modificados y devolver las nuevas
+# versiones. Se llama justo antes del commit para que el bloqueo de la fila de
+# VERSIONTABLA dure lo menos posible. Como las transacciones esperan ese bloqueo,
+# las versiones quedan en el mismo orden en que se confirman las escrituras.
+def incrementar(cursor, *tablas):
+    nuevas = {}
+    for tabla in sorted(set(tablas)):
+        # LAST_INSERT_ID(expr) hace que el servidor devuelva la nueva versión en lastrowid
+        cursor.execute('''
+            INSERT INTO VERSIONTABLA (tabla, version) VALUES (%s, LAST_INSERT_ID(1))
+            ON DUPLICATE KEY UPDATE version = LAST_INSERT_ID(version + 1)
+        ''', (tabla,))
+        nuevas[tabla] = cursor.lastrowid
+    return nuevas
+
+
+# Versiones de los catálogos leídas desde VERSIONTABLA, guardadas en memoria
+# durante `ttl` segundos para que validar un ETag no cueste una consulta por solicitud
+class TableVersions:
+    def __init__(self, get_connection, ttl=1):
+        self._get_connection = get_connection
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._versions = {}
+        self._loaded_at = None
+
+    def _load(self):
+        connection = self._get_connection()
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT tabla, version FROM VERSIONTABLA')
+                versions = {row['tabla']: row['version'] for row in cursor.fetchall()}
+        finally:
+            connection.close()
+
+        with self._lock:
+            self._versions = versions
+            self._loaded_at = time.monotonic()
+
+    def get(self, tabla):
+        if self._loaded_at is None or time.monotonic() - self._loaded_at > self.ttl:
+            self._load()
+        return self._versions.get(tabla, 0)
+
+    # Forzar la relectura después de una escritura hecha por este proceso
+    def invalidate(self):
+        with self._lock:
+            self._loaded_at = None
+
+    # ETag de una respuesta que depende de los catálogos indicados. `variante`
+    # distingue las representaciones de una misma versión (ruta y parámetros).
+    def etag(self, tablas, variante=''):
+        return etag_de({tabla: self.get(tabla) for tabla in tablas}, variante)
+
+
+# ETag a partir de versiones {nombre: versión} y de la variante de la respuesta
+def etag_de(versiones, variante=''):
+    texto = '.'.join(f'{nombre}{version}' for nombre, version in versiones.items())
+    digest = hashlib.sha1(variante.encode('utf-8')).hexdigest()[:12]
+    return f'{texto}-{digest}'
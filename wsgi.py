@@ -0,0 +1,9 @@
+# Punto de entrada para producción (un worker por proceso, ver README):
+#   gunicorn --worker-class eventlet --workers 1 --bind 0.0.0.0:5000 wsgi:app
+# Para varios procesos se levantan varias instancias detrás de un balanceador
+# con sesiones persistentes y SOCKETIO_MESSAGE_QUEUE apuntando a la misma cola.
+from app import app, socketio
+
+if __name__ == '__main__':
+    import os
+    socketio.run(app, host=os.getenv('API_HOST', '0.0.0.0'), port=int(os.getenv('API_PORT', 5000)))